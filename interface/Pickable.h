@@ -3,6 +3,7 @@
 //-----------------------------------------------------------------------------
 // Package:    PhysicsTools/PyGui
 // Created:    Created: April 2016 HBP
+// Updated:    18-Oct-2026 picking of the digits of a digit set
 //-----------------------------------------------------------------------------
 #include <iostream>
 #include <vector>
@@ -10,6 +11,7 @@
 //-----------------------------------------------------------------------------
 #include "TQObject.h"
 #include "TEveSelection.h"
+#include "TEveDigitSet.h"
 //-----------------------------------------------------------------------------
 class Pickable : public TQObject
 {
@@ -22,14 +24,22 @@ class Pickable : public TQObject
   void Clear();
   TEveElement* operator[](int id);
 
+  // a digit set (e.g. a TEveBoxSet) whose digits can be picked: picking
+  // digit Digit() of the set emits Picked(id of the set)
+  void AddDigits(TEveDigitSet* digits);
+  void DigitSelected(TEveDigitSet* digits, Int_t idx);
+  int  Digit() const;
+
   void Selected(int id);     //*SIGNAL*
   void Cleared();            //*SIGNAL*
+  void Picked(int id);       //*SIGNAL*
   
  private:
   TEveSelection* _selection;
   std::map<TEveElement*, int> _element2id;
   std::map<int, TEveElement*> _id2element;
   int _id;
+  int _digit;
 
  public:
   ClassDef(Pickable,0)       // Needed to get signals to work
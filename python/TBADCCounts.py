@@ -5,6 +5,7 @@
 # Created:     10-Apr-2016 Jeremy Thomas, Harrison B. Prosper
 #-----------------------------------------------------------------------------
 import sys, os, re
+import numpy as np
 from string import atof, lower, replace, strip, split, joinfields, find
 from HGCal.TBEventDisplay.TBUtil import *
 from HGCal.TBStandaloneSimulator.TBGeometryUtil import *
@@ -14,7 +15,6 @@ from ROOT import *
 class ADCCounts:
 
     def __init__(self, parent, page):
-        self.cellmap = parent.cellmap
         self.geometry  = parent.geometry
         self.sensitive = parent.sensitive
         self.canvas  = page.canvas
@@ -41,41 +41,54 @@ class ADCCounts:
             h.GetYaxis().SetTitle("count")
             self.hist.append(h)
 
+        # cell -> bin of the layer's channel histogram, computed once.
+        # The contents of all histograms, under- and overflow included,
+        # form one (layer, bin) array filled from the cell counts.
+        store = parent.store
+        nrows = min(self.nplots, store.nlayers)
+        rows, cells = [], []
+        for l in xrange(nrows):
+            n = store.ncell[l]
+            rows.append(np.repeat(l, n))
+            cells.append(np.arange(n))
+        self.rows  = np.concatenate(rows)
+        self.cells = np.concatenate(cells)
+        ski = (store.skiroc[self.rows, self.cells]+1) % 2
+        self.bins  = store.channel[self.rows, self.cells] + 64 * ski + 1
+        self.contents = np.zeros((self.nplots, nbins+2))
+        self.drawn = False
+
     def __del__(self):
         pass
 
     def Draw(self, parent):
-        if parent.hits == None: return
+        if parent.hits is None: return
 
-        # check if we are in accumulate mode
-        if not parent.accumulate:
-            for h in self.hist:
-                h.Reset()
+        # the cell counts already hold the sum over events in
+        # accumulate mode, so the contents are simply overwritten
+        store = parent.store
+        contents = self.contents
+        contents[self.rows, self.bins] = store.count[self.rows, self.cells]
+        ymax = 1.1 * contents.max()
 
         gStyle.SetOptStat("")
-        ymax = 0.0
         for ii, h in enumerate(self.hist):
             layer = ii + 1
-            cells = parent.cells[layer]
-            for ii in xrange(cells.size()):
-                cell   = cells[ii]
-                skiroc = cell.skiroc
-                channel= cell.channel
-                ski = (skiroc+1) % 2
-                jj = channel + 64 * ski + 1
-                h.SetBinContent(jj, cell.count)
-                if cell.count > ymax:
-                    ymax = cell.count
-            self.canvas.cd(layer)
-
-        ymax *= 1.1
-        for ii, h in enumerate(self.hist):
-            layer = ii + 1
-            self.canvas.cd(layer)
+            h.SetContent(contents[ii])
             h.SetMaximum(ymax)
-            h.Draw()
+            if self.drawn:
+                self.canvas.GetPad(layer).Modified()
+            else:
+                self.canvas.cd(layer)
+                h.Draw()
+        self.drawn = True
+
+        start = parent.stages.mark()
         self.canvas.Update()
+        parent.stages.add('update', start)
 
         if parent.shutterOpen:
             filename = "channels%5.5d.png" % parent.eventNumber
+            start = parent.stages.mark()
             self.canvas.SaveAs(filename)
+            parent.stages.add('save', start)
@@ -0,0 +1,88 @@
+#-----------------------------------------------------------------------------
+# File:        TBAccumulator.py
+# Description: TB 2016 accumulation of cell counts over a range of events
+#              in a background thread
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, time, threading
+import numpy as np
+from HGCal.TBEventDisplay.TBUtil import *
+#------------------------------------------------------------------------------
+# the accumulator does ROOT I/O outside the GUI thread: see
+# TBPrefetcher.enableThreads, which must be called before it starts
+#------------------------------------------------------------------------------
+class Accumulator(threading.Thread):
+    # sum the adc counts of every cell over a list of events. The worker
+    # uses its own file reader and touches no ROOT histograms: the hits
+    # are mapped to cell keys with the (read-only) cell store and summed
+    # with one bincount per chunk of events. When the thread has finished,
+    # counts holds one sum per cell key and saturated whether a hit of the
+    # cell had a saturated high gain, ready for
+    # DataCache.fillDataCacheCounts, and elapsed the time (s) taken.
+    # Progress is given by processed. If given, progress(processed) is
+    # called by the worker after each event.
+
+    def __init__(self, reader, decoder, store, events, chunk=500,
+                 progress=None):
+        threading.Thread.__init__(self)
+        self.daemon    = True
+        self.reader    = reader
+        self.decoder   = decoder
+        self.store     = store
+        self.events    = events
+        self.chunk     = chunk
+        self.progress  = progress
+        self.size      = store.nlayers * store.ncells
+        self.counts    = np.zeros(self.size)
+        self.saturated = np.zeros(self.size, np.bool_)
+        self.processed = 0
+        self.elapsed   = 0.0
+        self.cancelled = threading.Event()
+
+    def __del__(self):
+        pass
+
+    def run(self):
+        start  = time.time()
+        reader = self.reader
+        keys = []
+        adcs = []
+        sats = []
+        for number in self.events:
+            if self.cancelled.is_set(): break
+            reader.read(number)
+            hits = getHits(reader, self.decoder)
+            if hits is not None and len(hits) > 0:
+                k  = self.store.keys(hits)
+                ok = k >= 0
+                keys.append(k[ok])
+                adcs.append(hits['adc'][ok])
+                sats.append(hits['saturated'][ok])
+            self.processed += 1
+            if len(keys) >= self.chunk:
+                self.add(keys, adcs, sats)
+                keys = []
+                adcs = []
+                sats = []
+            if self.progress: self.progress(self.processed)
+        self.add(keys, adcs, sats)
+        reader.close()
+        self.elapsed = time.time() - start
+
+    def add(self, keys, adcs, sats):
+        if len(keys) == 0: return
+        keys = np.concatenate(keys)
+        self.counts += np.bincount(keys, weights=np.concatenate(adcs),
+                                   minlength=self.size)
+        self.saturated[keys[np.concatenate(sats)]] = True
+
+    def rate(self):
+        # events per second
+        return self.processed / max(self.elapsed, 1e-9)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.join()
+
+    def wasCancelled(self):
+        return self.cancelled.is_set()
@@ -0,0 +1,217 @@
+#-----------------------------------------------------------------------------
+# File:        TBBatch.py
+# Description: TB 2016 headless rendering of display pages to image files
+#              (TBEventDisplay.py --batch ...)
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re, time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from ROOT import *
+#------------------------------------------------------------------------------
+# no GUI: run ROOT in batch mode before any canvas is made, and enable
+# the auto loader here since Util.py (which does so for the GUI) needs
+# an X display
+gROOT.SetBatch(kTRUE)
+if gSystem.Load('libFWCoreFWLite') != 0:
+    sys.exit('**unable to load libFWCoreFWLite')
+FWLiteEnabler.enable()
+
+from HGCal.TBEventDisplay.TBUtil import *
+from HGCal.TBEventDisplay.TBDataCache import DataCache
+from HGCal.TBEventDisplay.TBStageTimer import writeTimings
+from HGCal.TBEventDisplay.TBADCCounts import ADCCounts
+from HGCal.TBEventDisplay.TBHeatMap import HeatMap
+from HGCal.TBEventDisplay.TBLego import Lego
+from HGCal.TBEventDisplay.TBEventStore import openReader
+#------------------------------------------------------------------------------
+# pages that can be drawn without the GUI: name -> (class, file prefix).
+# Display3D needs an embedded GL viewer and is not available in batch.
+PAGES = {'Channels': (ADCCounts, 'channels'),
+         'HeatMap':  (HeatMap,   'heatmap'),
+         'LegoPlot': (Lego,      'lego')}
+
+WIDTH  = 1200
+HEIGHT =  900
+#------------------------------------------------------------------------------
+class Page:
+    def __init__(self, name, width=WIDTH, height=HEIGHT):
+        self.name   = name
+        self.canvas = TCanvas('c%s' % name, name, width, height)
+
+    def __del__(self):
+        pass
+#------------------------------------------------------------------------------
+class BatchRenderer(DataCache):
+    # the parts of TBEventDisplay that the pages use, minus the GUI
+
+    def __init__(self, geometryModule, files, pages,
+                 ADCmin=300, setMaxAll=False, counts=None,
+                 pedestals=None, ksigma=3.0, quantity='sample0',
+                 gains=None):
+        self.accumulate = False
+        self.ADCmin     = ADCmin
+        self.setMaxAll  = setMaxAll
+        self.shutterOpen= False
+        self.eventNumber=-1
+        self.initGeometry(geometryModule)
+        self.initDataCache()
+        self.decoder.ksigma = ksigma
+        self.decoder.quantity = quantity
+        if pedestals != None:
+            self.decoder.pedestals = self.decoder.newPedestals()
+            self.decoder.pedestals.load(pedestals)
+        if gains != None:
+            self.decoder.gains = self.decoder.newGains()
+            self.decoder.gains.load(gains)
+
+        self.reader  = openReader(files, counts)
+        self.filename= self.reader.name
+        self.nevents = self.reader.entries()
+
+        self.pages   = []
+        for name in pages:
+            constructor, prefix = PAGES[name]
+            page = Page(name)
+            self.pages.append((page, constructor(self, page), prefix))
+
+    def __del__(self):
+        pass
+
+    def render(self, eventNumber, outdir, formats):
+        # draw every page for one event and save it in each format.
+        # Returns the names of the files written.
+        self.eventNumber = eventNumber
+        stages = self.stages
+        stages.event(eventNumber)
+        start = stages.mark()
+        self.reader.read(eventNumber)
+        stages.add('read', start)
+        start = stages.mark()
+        hits  = getHits(self.reader, self.decoder)
+        stages.add('decode', start)
+        self.fillDataCache(hits)
+        filenames = []
+        for page, display, prefix in self.pages:
+            start = stages.mark()
+            display.Draw(self)
+            stages.add('draw', start)
+            for fmt in formats:
+                filename = os.path.join(outdir, '%s%5.5d.%s' % \
+                                            (prefix, eventNumber, fmt))
+                start = stages.mark()
+                page.canvas.SaveAs(filename)
+                stages.add('save', start)
+                filenames.append(filename)
+        return filenames
+#------------------------------------------------------------------------------
+# worker processes: each builds its own renderer (reader and geometry)
+RENDERER = None
+OPTIONS  = None
+
+def initWorker(options):
+    global RENDERER, OPTIONS
+    OPTIONS  = options
+    RENDERER = BatchRenderer(options.geometry, options.filename,
+                             options.pages, options.ADCmin,
+                             counts=options.counts,
+                             pedestals=options.pedestals,
+                             ksigma=options.ksigma,
+                             quantity=options.quantity,
+                             gains=options.gains)
+
+def renderEvents(events):
+    # returns the files written and the per-event timings of the chunk
+    filenames = []
+    for eventNumber in events:
+        filenames += RENDERER.render(eventNumber,
+                                     OPTIONS.outdir, OPTIONS.formats)
+    rows = list(RENDERER.stages.rows)
+    RENDERER.stages.rows.clear()
+    return (filenames, rows)
+#------------------------------------------------------------------------------
+def chunks(events, size):
+    return [events[ii:ii+size] for ii in xrange(0, len(events), size)]
+#------------------------------------------------------------------------------
+def main(argv):
+    parser = ArgumentParser(prog='TBEventDisplay.py --batch',
+                            description='render event display pages '\
+                                'to image files without a display')
+    parser.add_argument('--batch', action='store_true',
+                        help='run without the GUI')
+    parser.add_argument('geometry', help='geometry file')
+    parser.add_argument('filename', nargs='+',
+                        help='root files of SKIROC data frames: files, '\
+                            'globs, run directories or text files '\
+                            'listing files; or a hit store')
+    parser.add_argument('--pages', default='Channels,HeatMap,LegoPlot',
+                        help='comma separated pages from %s' % \
+                            ', '.join(sorted(PAGES.keys())))
+    parser.add_argument('--events', default='',
+                        help='events to render, e.g. 0-499 or 3,7,12 '\
+                            '(default: all)')
+    parser.add_argument('--formats', default='png',
+                        help='comma separated image formats, e.g. png,pdf')
+    parser.add_argument('--outdir', default='.',
+                        help='output directory')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--ADCmin', type=float, default=300,
+                        help='minimum number of adc counts')
+    parser.add_argument('--pedestals', default=None, metavar='NPZ',
+                        help='subtract the pedestals in this file')
+    parser.add_argument('--ksigma', type=float, default=3.0,
+                        help='with --pedestals, drop hits less than this '\
+                            'many noise rms above pedestal')
+    parser.add_argument('--quantity', default='sample0', choices=QUANTITIES,
+                        help='pulse quantity shown as the adc count of '\
+                            'each hit (default: %(default)s)')
+    parser.add_argument('--gains', default=None, metavar='TXT',
+                        help='replace saturated high-gain samples by the '\
+                            'low gain, using the calibration in this file')
+    parser.add_argument('--timings', default=None, metavar='CSV',
+                        help='write the time of each stage of each event '\
+                            'to this file')
+    options = parser.parse_args(argv)
+
+    options.pages = [p for p in options.pages.split(',') if p]
+    for name in options.pages:
+        if not PAGES.has_key(name):
+            parser.error('page %s cannot be rendered in batch mode' % name)
+    options.formats = [f for f in options.formats.split(',') if f]
+    if not os.path.exists(options.outdir):
+        os.makedirs(options.outdir)
+
+    # count the events once; the workers reuse the counts
+    reader  = openReader(options.filename)
+    nevents = reader.entries()
+    options.counts = reader.counts.tolist()
+    events  = decodeEventList(options.events, nevents)
+    if len(events) == 0:
+        print '** no events to render'
+        return 0
+
+    t0 = time.time()
+    jobs = max(1, min(options.jobs, len(events)))
+    if jobs == 1:
+        initWorker(options)
+        filenames, rows = renderEvents(events)
+    else:
+        # several chunks per worker so that the load balances
+        size  = max(1, len(events) / (4*jobs))
+        pool  = Pool(jobs, initWorker, (options,))
+        filenames = []
+        rows = []
+        for names, times in pool.imap_unordered(renderEvents,
+                                                chunks(events, size)):
+            filenames += names
+            rows += times
+        pool.close()
+        pool.join()
+    print 'rendered %d events (%d files) in %.1f s using %d process(es)' % \
+        (len(events), len(filenames), time.time()-t0, jobs)
+    if options.timings:
+        rows.sort()
+        writeTimings(options.timings, rows)
+        print 'timings written to %s' % options.timings
+    return 0
@@ -0,0 +1,448 @@
+#-----------------------------------------------------------------------------
+# File:        TBBenchmark.py
+# Description: TB 2016 timing of decoding, filling and drawing synthetic
+#              events (TBEventDisplay.py --benchmark ...). Needs neither
+#              data files nor FWLite and its dictionaries, except to draw
+#              Display3D.
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re, time, json, platform, copy
+import numpy as np
+from math import sqrt
+from argparse import ArgumentParser
+from HGCal.TBEventDisplay.TBUtil import *
+from HGCal.TBEventDisplay.TBDataCache import DataCache
+from HGCal.TBEventDisplay.TBADCCounts import ADCCounts
+from HGCal.TBEventDisplay.TBHeatMap import HeatMap
+from HGCal.TBEventDisplay.TBLego import Lego
+from HGCal.TBEventDisplay.TBPrefetcher import Prefetcher, enableThreads
+from HGCal.TBEventDisplay.TBAccumulator import Accumulator
+from ROOT import *
+#------------------------------------------------------------------------------
+# change when what is timed, or how, changes
+BENCHMARK_VERSION = 4
+# accumulate: per event, Accumulate range (compare with getHits plus
+# fillDataCache, the cost per event of accumulating with the player)
+STAGES = ['getHits', 'fillDataCache', 'accumulate']
+# pages drawn on a canvas, with ROOT in batch mode. Display3D needs an X
+# display and GL, so it is timed only if asked for, without batch mode.
+PAGES  = {'Channels': ADCCounts,
+          'HeatMap':  HeatMap,
+          'LegoPlot': Lego}
+WIDTH  = 1200
+HEIGHT =  900
+#------------------------------------------------------------------------------
+# geometry stand-in: the layout of createGeometry's output (absorber and
+# silicon per layer) with a hexagonal wafer of 127 hexagonal cells
+# (|u|, |v|, |u+v| <= RINGS) read out by two SKIROCs.
+RINGS    = 6
+CELLSIDE = 0.6496     # cm
+PITCH    = 1.2        # cm, distance between layers
+# shape of the synthetic pulses, one value per time sample
+PULSE    = [0.4, 1.0, 0.8, 0.5, 0.3, 0.2]
+# the high gain saturates here; the low gain is RATIO times smaller
+SATURATION = 1800
+RATIO      = 10
+#------------------------------------------------------------------------------
+def hexagon(side, x=0.0, y=0.0):
+    a  = np.pi*np.arange(6)/3
+    return (x + side*np.cos(a), y + side*np.sin(a))
+
+def syntheticCells(rings=RINGS, side=CELLSIDE):
+    # cell table of one layer, as made by TBGeometryCache.cellTable
+    u, v = [], []
+    for iu in xrange(-rings, rings+1):
+        for iv in xrange(-rings, rings+1):
+            if abs(iu + iv) <= rings:
+                u.append(iu)
+                v.append(iv)
+    n = len(u)
+    table = {}
+    table['u'] = np.array(u, np.int32)
+    table['v'] = np.array(v, np.int32)
+    table['x'] = 1.5*side*table['u']
+    table['y'] = sqrt(3)*side*(table['v'] + 0.5*table['u'])
+    table['skiroc']  = (np.arange(n) / 64).astype(np.int32)
+    table['channel'] = (np.arange(n) % 64).astype(np.int32)
+    xv, yv = [], []
+    for ii in xrange(n):
+        x, y = hexagon(side, table['x'][ii], table['y'][ii])
+        xv.append(x)
+        yv.append(y)
+    table['xv'] = np.concatenate(xv)
+    table['yv'] = np.concatenate(yv)
+    table['offset'] = 6*np.arange(n+1, dtype=np.int32)
+    return table
+
+def syntheticGeometry(nlayers, rings=RINGS, side=CELLSIDE):
+    # same keys as TBGeometryCache.buildGeometry
+    wafer = (2*rings+1)*side
+    geometry  = []
+    sensitive = {}
+    cells     = {}
+    table     = syntheticCells(rings, side)
+    for l in xrange(nlayers):
+        layer = l + 1
+        z = layer*PITCH
+        geometry.append({'material': 'W', 'shape': 'hexagon',
+                         'side': wafer, 'thickness': 0.3,
+                         'x': 0.0, 'y': 0.0, 'z': z - 0.4})
+        sensitive[layer] = len(geometry)
+        geometry.append({'material': 'Si', 'shape': 'hexagon',
+                         'side': wafer, 'cellsize': side,
+                         'thickness': 0.03,
+                         'x': 0.0, 'y': 0.0, 'z': z})
+        cells[layer] = table
+    return {'geometry':  geometry,
+            'sensitive': sensitive,
+            'cells':     cells}
+#------------------------------------------------------------------------------
+# SKIROC data frame stand-ins: the calls HitDecoder.decode makes on a
+# collection, with its frame wrapper replaced by syntheticFrame
+class SyntheticDetId:
+    def __init__(self, layer, u, v):
+        self._layer, self._u, self._v = layer, u, v
+    def layer(self): return self._layer
+    def iu(self):    return self._u
+    def iv(self):    return self._v
+
+class SyntheticSample:
+    def __init__(self, adc):
+        self.adc = adc
+    def adcHigh(self): return min(self.adc, SATURATION)
+    def adcLow(self):  return self.adc / RATIO
+
+class SyntheticFrame:
+    def __init__(self, layer, u, v, adc):
+        self.id = SyntheticDetId(layer, u, v)
+        self.pulse = [SyntheticSample(int(adc*f)) for f in PULSE]
+    def detid(self):   return self.id
+    def samples(self): return len(self.pulse)
+    def __getitem__(self, ii): return self.pulse[ii]
+
+class SyntheticCollection(list):
+    def size(self): return len(self)
+
+def syntheticFrame(frame):
+    return frame
+#------------------------------------------------------------------------------
+class SyntheticReader:
+    # stands in for TBFileReader: events are generated in memory with a
+    # fraction occupancy of the cells of every layer hit. The adc counts
+    # are a pedestal-free exponential with a long tail.
+
+    def __init__(self, tables, nevents, occupancy, seed=12345):
+        rand   = np.random.RandomState(seed)
+        table  = tables['cells'][1]
+        ncell  = len(table['u'])
+        layers = sorted(tables['sensitive'].keys())
+        nhit   = max(1, int(round(occupancy*ncell)))
+        self.events = []
+        for n in xrange(nevents):
+            frames = SyntheticCollection()
+            for layer in layers:
+                cells = rand.choice(ncell, nhit, replace=False)
+                adc   = rand.exponential(400.0, nhit).astype(np.int32) + 1
+                for c, a in zip(cells.tolist(), adc.tolist()):
+                    frames.append(SyntheticFrame(layer, int(table['u'][c]),
+                                                 int(table['v'][c]), a))
+            self.events.append(frames)
+        self.current = None
+
+    def __del__(self):
+        pass
+
+    def clone(self):
+        # shares the events, has its own current event
+        return copy.copy(self)
+
+    def entries(self):
+        return len(self.events)
+
+    def read(self, eventNumber):
+        self.current = self.events[eventNumber]
+
+    def __call__(self, keyname):
+        return self.current
+
+    def close(self):
+        pass
+#------------------------------------------------------------------------------
+class Page:
+    # the parts of a notebook page that the canvas pages use
+    def __init__(self, name, width=WIDTH, height=HEIGHT):
+        self.name   = name
+        self.canvas = TCanvas('c%s' % name, name, width, height)
+
+    def __del__(self):
+        pass
+
+class Page3D:
+    # the parts of a notebook page that Display3D uses
+    def __init__(self, name):
+        self.name = name
+        self.elements      = TEveElementList('hits')
+        self.fixedelements = TEveElementList('geometry')
+        self.shapes        = []
+        gEve.AddElement(self.elements)
+        gEve.AddElement(self.fixedelements)
+
+    def __del__(self):
+        pass
+#------------------------------------------------------------------------------
+class BenchmarkRenderer(DataCache):
+    # the parts of TBEventDisplay that the pages use, on synthetic data
+
+    def __init__(self, tables, pages, ADCmin=300, gains=False):
+        self.geometryModule = 'synthetic'
+        self.accumulate = False
+        self.ADCmin     = ADCmin
+        self.setMaxAll  = False
+        self.shutterOpen= False
+        self.eventNumber=-1
+        self.initTables(tables)
+        self.initDataCache()
+        self.decoder.frame = syntheticFrame
+        # by default, time what the display decodes by default (sample
+        # 0 only); with gains, the merging of saturated high-gain samples
+        # with the low gain, which reads every sample of both gains
+        if gains:
+            self.decoder.gains = self.decoder.newGains()
+
+        self.pages = []
+        for name in pages:
+            if name == 'Display3D':
+                from HGCal.TBEventDisplay.TBDisplay3D import Display3D
+                page = Page3D(name)
+                self.pages.append((name, Display3D(self, page)))
+            else:
+                constructor = PAGES[name]
+                page = Page(name)
+                self.pages.append((name, constructor(self, page)))
+
+    def __del__(self):
+        pass
+#------------------------------------------------------------------------------
+def percentiles(t):
+    # summary, in ms, of a list of times in s
+    t = 1000*np.array(t)
+    p50, p95, p99 = np.percentile(t, [50, 95, 99])
+    return {'count': len(t), 'mean': t.mean(), 'p50': p50,
+            'p95': p95, 'p99': p99, 'total': t.sum()}
+
+def runConfig(nlayers, occupancy, nevents, pages, ADCmin, seed,
+              gains=False):
+    # time each stage of each event of one configuration
+    tables   = syntheticGeometry(nlayers)
+    reader   = SyntheticReader(tables, nevents, occupancy, seed)
+    renderer = BenchmarkRenderer(tables, pages, ADCmin, gains)
+    times = {}
+    for stage in STAGES + ['Draw:%s' % name for name in pages]:
+        times[stage] = []
+
+    nhits = 0
+    for n in xrange(nevents):
+        renderer.eventNumber = n
+        reader.read(n)
+        start = time.time()
+        hits  = getHits(reader, renderer.decoder)
+        times['getHits'].append(time.time() - start)
+        nhits += len(hits)
+
+        start = time.time()
+        renderer.fillDataCache(hits)
+        times['fillDataCache'].append(time.time() - start)
+
+        for name, display in renderer.pages:
+            start = time.time()
+            display.Draw(renderer)
+            times['Draw:%s' % name].append(time.time() - start)
+
+    # the worker's loop, run here on the main thread
+    last = [0.0]
+    def progress(processed):
+        now = time.time()
+        times['accumulate'].append(now - last[0])
+        last[0] = now
+    job  = Accumulator(reader.clone(), renderer.decoder, renderer.store,
+                       range(nevents), progress=progress)
+    last[0] = time.time()
+    job.run()
+
+    results = []
+    for stage in sorted(times.keys()):
+        result = {'layers': nlayers, 'occupancy': occupancy,
+                  'gains': gains,
+                  'hits': float(nhits) / max(nevents, 1), 'stage': stage}
+        result.update(percentiles(times[stage]))
+        results.append(result)
+    return results
+
+def runPlayer(nlayers, occupancy, nevents, pages, ADCmin, seed, depth,
+              gains=False):
+    # throughput of the event player: each event read, decoded, filled
+    # and drawn one after the other on one thread (player:serial), then
+    # read and decoded ahead by the prefetcher while the main thread
+    # fills and draws (player:prefetch). The times are those between
+    # successive draws; rate is in events/s.
+    tables   = syntheticGeometry(nlayers)
+    reader   = SyntheticReader(tables, nevents, occupancy, seed)
+    renderer = BenchmarkRenderer(tables, pages, ADCmin, gains)
+
+    def draw(n, hits):
+        renderer.eventNumber = n
+        renderer.fillDataCache(hits)
+        for name, display in renderer.pages:
+            display.Draw(renderer)
+
+    serial = []
+    last = time.time()
+    for n in xrange(nevents):
+        reader.read(n)
+        draw(n, getHits(reader, renderer.decoder))
+        now = time.time()
+        serial.append(now - last)
+        last = now
+
+    prefetch = []
+    worker = Prefetcher(reader.clone(), renderer.decoder, 0, 1,
+                        nevents, depth)
+    last = time.time()
+    worker.start()
+    while not worker.done():
+        event = worker.pop()
+        if event is None:
+            time.sleep(0.0005)
+            continue
+        n, hits, t = event
+        draw(n, hits)
+        now = time.time()
+        prefetch.append(now - last)
+        last = now
+    worker.stop()
+
+    results = []
+    for stage, times in [('player:serial', serial),
+                         ('player:prefetch', prefetch)]:
+        result = {'layers': nlayers, 'occupancy': occupancy,
+                  'gains': gains, 'hits': -1, 'stage': stage,
+                  'rate': len(times) / max(sum(times), 1e-9)}
+        result.update(percentiles(times))
+        results.append(result)
+    return results
+#------------------------------------------------------------------------------
+def compare(results, filename, threshold):
+    # print the ratio of the median time of each stage to that of an
+    # earlier run. Returns the number of stages slower than threshold.
+    def configKey(r):
+        return (r['layers'], r['occupancy'], r.get('gains', False),
+                r['stage'])
+    old = {}
+    for r in json.load(open(filename))['results']:
+        old[configKey(r)] = r
+    print '%6s %9s %5s %-18s %9s %9s %7s' % \
+        ('layers', 'occupancy', 'gains', 'stage', 'old p50', 'new p50',
+         'ratio')
+    slower = 0
+    for r in results:
+        key = configKey(r)
+        if not old.has_key(key): continue
+        ratio = r['p50'] / max(old[key]['p50'], 1e-6)
+        flag  = ''
+        if ratio > threshold:
+            flag = ' <==='
+            slower += 1
+        print '%6d %9.3f %5s %-18s %9.3f %9.3f %7.2f%s' % \
+            (key[0], key[1], ['no', 'yes'][key[2]], key[3],
+             old[key]['p50'], r['p50'], ratio, flag)
+    return slower
+#------------------------------------------------------------------------------
+def main(argv):
+    parser = ArgumentParser(prog='TBEventDisplay.py --benchmark',
+                            description='time the decoding, filling '\
+                                'and drawing of synthetic events')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='run the benchmark')
+    parser.add_argument('--layers', default='2,8,28',
+                        help='comma separated numbers of layers')
+    parser.add_argument('--occupancy', default='0.05,0.25,1.0',
+                        help='comma separated fractions of cells hit '\
+                            'in each layer')
+    parser.add_argument('--events', type=int, default=100,
+                        help='events per configuration')
+    parser.add_argument('--pages',
+                        default='Channels,HeatMap,LegoPlot',
+                        help='comma separated pages to draw: %s or '\
+                            'Display3D (needs a display)' % \
+                            ', '.join(sorted(PAGES.keys())))
+    parser.add_argument('--ADCmin', type=float, default=300,
+                        help='minimum number of adc counts')
+    parser.add_argument('--seed', type=int, default=12345,
+                        help='random number seed')
+    parser.add_argument('--gains', action='store_true',
+                        help='merge saturated high-gain samples with the '\
+                            'low gain (reads every sample of both gains)')
+    parser.add_argument('--player', action='store_true',
+                        help='also measure the throughput of the event '\
+                            'player with and without read-ahead')
+    parser.add_argument('--depth', type=int, default=10,
+                        help='with --player, events read ahead')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='results file (JSON)')
+    parser.add_argument('--compare', default=None, metavar='JSON',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='with --compare, flag stages whose median '\
+                            'time grew by more than this factor')
+    options = parser.parse_args(argv)
+
+    layers    = [int(x) for x in options.layers.split(',') if x]
+    occupancy = [float(x) for x in options.occupancy.split(',') if x]
+    pages     = [p for p in options.pages.split(',') if p]
+    for name in pages:
+        if name != 'Display3D' and not PAGES.has_key(name):
+            parser.error('unknown page %s' % name)
+    if 'Display3D' in pages:
+        # Eve cannot run in batch mode, and Display3D uses the classes
+        # of this package (Connection, Pickable), found by the auto loader
+        if gSystem.Load('libFWCoreFWLite') != 0:
+            sys.exit('**Display3D needs libFWCoreFWLite')
+        FWLiteEnabler.enable()
+        TEveManager.Create(kFALSE)
+    else:
+        gROOT.SetBatch(kTRUE)
+    if options.player:
+        enableThreads()
+
+    results = []
+    for nlayers in layers:
+        for occ in occupancy:
+            print 'layers %3d  occupancy %5.3f  gains %s' % \
+                (nlayers, occ, ['no', 'yes'][options.gains])
+            results += runConfig(nlayers, occ, options.events, pages,
+                                 options.ADCmin, options.seed,
+                                 options.gains)
+            if options.player:
+                results += runPlayer(nlayers, occ, options.events, pages,
+                                     options.ADCmin, options.seed,
+                                     options.depth, options.gains)
+                print '  player %8.1f ev/s serial %8.1f ev/s prefetch' % \
+                    (results[-2]['rate'], results[-1]['rate'])
+
+    record = {'version':  BENCHMARK_VERSION,
+              'created':  time.strftime('%Y-%m-%d %H:%M:%S'),
+              'host':     platform.node(),
+              'python':   platform.python_version(),
+              'root':     gROOT.GetVersion(),
+              'events':   options.events,
+              'seed':     options.seed,
+              'units':    'ms',
+              'results':  results}
+    out = open(options.output, 'w')
+    json.dump(record, out, indent=1, sort_keys=True)
+    out.close()
+    print 'results written to %s' % options.output
+
+    if options.compare:
+        return min(compare(results, options.compare, options.threshold), 1)
+    return 0
@@ -0,0 +1,141 @@
+#-----------------------------------------------------------------------------
+# File:        TBDataCache.py
+# Description: TB 2016 geometry and per-event data cache shared by the
+#              event display and the batch renderer
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re
+import numpy as np
+from array import array
+from HGCal.TBEventDisplay.TBUtil import *
+from HGCal.TBEventDisplay.TBGeometryCache import loadGeometry
+from HGCal.TBEventDisplay.TBStageTimer import StageTimer
+from HGCal.TBStandaloneSimulator.TBGeometryUtil import *
+from ROOT import *
+#------------------------------------------------------------------------------
+class DataCache:
+    # expects the attributes accumulate, ADCmin and setMaxAll to be set
+    # by the class that uses it
+
+    def initGeometry(self, geometryModule):
+        self.geometryModule = geometryModule
+        # get test beam geometry and the cell tables of each layer
+        self.initTables(loadGeometry(geometryModule))
+
+    def initTables(self, tables):
+        # tables: as returned by loadGeometry
+        # histogram cache (one per sensor)
+        self.hist       = []
+        self.geometry   = tables['geometry']
+        self.sensitive  = tables['sensitive']
+        self.cells      = tables['cells']
+        # decoder of SKIROC data frames into hit arrays
+        self.decoder    = HitDecoder(self.cells,
+                                     self.geometry, self.sensitive)
+        self.hits       = None
+        self.maxCount   = 0.0
+
+    def initDataCache(self):
+        # -------------------------------------------------------------
+        # create a histogram for each sensor
+        # Note: in offline, layers start at 1
+        # -------------------------------------------------------------
+
+        # per-cell state shared, read-only, by all pages, and the keys
+        # of the cells filled since the last reset
+        self.store   = CellStore(self.cells, self.geometry, self.sensitive,
+                                 self.decoder.index)
+        self.touched = np.zeros(0, np.int64)
+        # incremented each time the cache is filled
+        self.generation = 0
+        # latency of each stage of reading, filling and drawing events
+        self.stages  = StageTimer()
+
+        for l in xrange(len(self.sensitive)):
+            layer = l + 1
+            poly = TH2Poly()
+            poly.SetName('layer %3d' % layer)
+            poly.SetTitle('layer %3d' % layer)
+            poly.GetXaxis().CenterTitle()
+            poly.GetXaxis().SetTitle("#font[12]{x} axis")
+            poly.GetYaxis().CenterTitle()
+            poly.GetYaxis().SetTitle("#font[12]{y} axis")
+
+            # populate histogram with cells; the bins are added in cell
+            # order, so cell ii of the store is bin ii+1
+            table  = self.cells[layer]
+            xv     = table['xv']
+            yv     = table['yv']
+            offset = table['offset'].tolist()
+            for ii in xrange(len(offset)-1):
+                a, b = offset[ii], offset[ii+1]
+                poly.AddBin(b-a, array('d', xv[a:b].tolist()),
+                                 array('d', yv[a:b].tolist()))
+
+            # cache sensor histogram
+            self.hist.append(poly)
+
+    def fillDataCache(self, hits):
+        # -------------------------------------------------------------
+        start = self.stages.mark()
+        if not self.accumulate:
+            self.clearBins()
+        self.generation += 1
+
+        self.hits = hits
+        if self.hits is not None:
+            # fill cell store and sensor histograms
+            self.updateCache(self.fillBins(self.hits))
+        self.stages.add('fill', start)
+
+    def fillDataCacheCounts(self, counts, saturated=None):
+        # add per-cell counts summed over many events, and the cells with
+        # a saturated hit (see TBAccumulator)
+        self.generation += 1
+        # the pages draw nothing until some hits have been seen
+        if self.hits is None:
+            self.hits = np.zeros(0, HIT_DTYPE)
+        keys = self.store.addCounts(counts, saturated)
+        self.writeBins(keys)
+        self.updateCache(keys)
+
+    def updateCache(self, keys):
+        # record the cells filled and update the histogram limits
+        self.touched = np.union1d(self.touched, keys)
+
+        if len(self.touched) > 0:
+            self.maxCount = self.store.count.flat[self.touched].max()
+        else:
+            self.maxCount = 0.0
+
+        # set all histograms to min/max values
+        for h in self.hist:
+            h.SetMinimum(self.ADCmin)
+            if self.setMaxAll > 0:
+                h.SetMaximum(self.maxCount)
+            else:
+                h.SetMaximum()
+
+    def fillBins(self, hits):
+        # add the adc counts of the hits to the cell store and write the
+        # new contents directly into the TH2Poly bins, which avoids the
+        # point-in-polygon search done by TH2Poly::Fill. Returns the keys
+        # of the cells that were filled.
+        keys = self.store.add(hits)
+        self.writeBins(keys)
+        return keys
+
+    def writeBins(self, keys):
+        # copy the counts of the given cells into their TH2Poly bins
+        count = self.store.count.flat[keys]
+        for key, adc in zip(keys.tolist(), count.tolist()):
+            l, ii = divmod(key, self.store.ncells)
+            self.hist[l].SetBinContent(ii+1, adc)
+
+    def clearBins(self):
+        # reset only the cells and bins filled since the last reset
+        for key in self.touched.tolist():
+            l, ii = divmod(key, self.store.ncells)
+            self.hist[l].SetBinContent(ii+1, 0)
+        self.store.reset(self.touched)
+        self.touched = np.zeros(0, np.int64)
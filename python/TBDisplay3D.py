@@ -5,6 +5,7 @@
 # Created:     10-Apr-2016 Jeremy Thomas, Harrison B. Prosper
 #-----------------------------------------------------------------------------
 import sys, os, re
+import numpy as np
 from ROOT import *
 from string import atof, lower, replace, strip, split, joinfields, find
 from array import array
@@ -17,12 +18,59 @@ COLOR = {'W':   kRed-3,
          'WCu': kOrange, 
          'PCB': kBlue, 
          'Si':  kWhite}
+
+# depth (cm) of the box drawn for a hit
+DEPTH = 0.3
+#------------------------------------------------------------------------------
+class HitLayer:
+    # the hits of one layer, drawn as a single box set with a colour per
+    # box. Picking a box resolves, through its index, to the cell of the
+    # layer.
+
+    def __init__(self, store, layer, size):
+        self.store = store
+        self.layer = layer
+        self.size  = size
+        self.cells = np.zeros(0, np.int32)
+        self.boxes = TEveBoxSet('hits layer %d' % layer)
+        self.boxes.Reset(TEveBoxSet.kBT_AABoxFixedDim, kTRUE, 64)
+        self.boxes.SetDefWidth(size)
+        self.boxes.SetDefHeight(size)
+        self.boxes.SetDefDepth(DEPTH)
+
+    def __del__(self):
+        pass
+
+    def fill(self, cells, colors):
+        # cells: indices, in the cell store, of the hits to draw and
+        # colors their colour indices
+        if len(cells) == 0 and len(self.cells) == 0: return
+        self.cells = cells
+        l = self.layer - 1
+        # a box is placed by its lower corner
+        x = (self.store.x[l, cells] - 0.5*self.size).tolist()
+        y = (self.store.y[l, cells] - 0.5*self.size).tolist()
+        z = (self.store.z[l, cells] - 0.5*DEPTH).tolist()
+        boxes = self.boxes
+        boxes.Reset()
+        for xi, yi, zi, color in zip(x, y, z, colors.tolist()):
+            boxes.AddBox(xi, yi, zi)
+            boxes.DigitColor(color)
+        boxes.RefitPlex()
+        boxes.ElementChanged()
+
+    def picked(self, idd):
+        if idd < 0 or idd >= len(self.cells): return
+        l  = self.layer - 1
+        ii = self.cells[idd]
+        print 'hit: layer %d (u, v) = (%d, %d)  adc = %d' % \
+            (self.layer, self.store.u[l, ii], self.store.v[l, ii],
+             self.store.count[l, ii])
 #------------------------------------------------------------------------------
 class Display3D:
 
     def __init__(self, parent, page):
 
-        self.cellmap = parent.cellmap
         # this is a 2-tuple: (geometry_description, sensitive_elements)
         self.geometry  = parent.geometry
         self.sensitive = parent.sensitive
@@ -30,6 +78,11 @@ class Display3D:
         self.page    = page
         self.first   = True
         self.transparency = 99
+        # hits: one box set per layer, created once and refilled for
+        # each event. The hit pickables are never cleared; the id of a
+        # box set is its layer-1.
+        self.hitlayers = []
+        self.hitpickables = Pickable()
 
         # some shapes might be pickable
         self.pickables = Pickable()
@@ -40,6 +93,9 @@ class Display3D:
         self.connections.append(Connection(self.pickables, 
                                            "Cleared()",
                                            self, "cleared"))
+        self.connections.append(Connection(self.hitpickables,
+                                           "Picked(int)",
+                                           self, "picked"))
     def __del__(self):
         pass
 
@@ -58,14 +114,15 @@ class Display3D:
         # todo
         pass
 
+    def picked(self, idd):
+        if idd < 0 or idd >= len(self.hitlayers): return
+        self.hitlayers[idd].picked(self.hitpickables.Digit())
+
     #----------------------------------------------------------------------
     # Draw wafer and hits
     #----------------------------------------------------------------------
     def Draw(self, parent):	
 
-        # clear previous hits
-        self.page.elements.DestroyElements()
-
         # clear all pickables from the list
         # of selected pickables
         self.pickables.Clear()
@@ -87,7 +144,9 @@ class Display3D:
         #shape.RefMainTrans().SetPos(12, 12, 20)
         #elements.AddElement(shape)
 
+        start = parent.stages.mark()
         self.Show()
+        parent.stages.add('update', start)
 
         if parent.shutterOpen:
             filename = "display3d%5.5d.cc" % parent.eventNumber
@@ -133,24 +192,22 @@ class Display3D:
             self.page.shapes.append(shape)
 
     def drawHits(self, parent):
-        if parent.hits == None: return
-        
+        if parent.hits is None: return
+
+        store = parent.store
+        if len(self.hitlayers) == 0:
+            for l in xrange(self.nlayers):
+                layer = l + 1
+                size  = self.geometry[self.sensitive[layer]]['cellsize']
+                hitlayer = HitLayer(store, layer, size)
+                self.page.elements.AddElement(hitlayer.boxes)
+                self.hitpickables.AddDigits(hitlayer.boxes)
+                self.hitlayers.append(hitlayer)
+
+        # the colours of all cells, with one palette lookup
+        maxCount = max(parent.maxCount, 1)
+        colors   = colorTable.colors(store.count, maxCount)
         for l in xrange(self.nlayers):
-            layer = l + 1
-            cells = parent.cells[layer]
-            for ii in xrange(cells.size()):
-                cell = cells[ii]
-                if cell.count < parent.ADCmin: continue
-
-                name = 'hit%d_%d_%d_%d' % (parent.eventNumber, 
-                                           layer, cell.u, cell.v)
-                p = TEvePointSet(name)
-                p.SetNextPoint(cell.x, cell.y, cell.z)
-                p.SetPointId(TNamed(name, name))
-                p.SetMarkerStyle(4)
-                p.SetMarkerSize(2.0)
-                color = getColor(cell.count, parent.maxCount)
-                p.SetMarkerColor(color)
-                p.SetPickable(1)
-                self.pickables.AddElement(p)
-                self.page.elements.AddElement(p)
+            count = store.count[l, :store.ncell[l]]
+            cells = np.flatnonzero(count >= parent.ADCmin)
+            self.hitlayers[l].fill(cells, colors[l, cells])
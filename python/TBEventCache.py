@@ -0,0 +1,63 @@
+#-----------------------------------------------------------------------------
+# File:        TBEventCache.py
+# Description: TB 2016 cache of decoded events
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os
+from collections import OrderedDict
+#------------------------------------------------------------------------------
+class EventCache:
+    # least-recently-used cache of decoded events, keyed by
+    # (filename, eventNumber). The cache holds at most budget bytes of
+    # hit arrays; the least recently used events are dropped first.
+
+    def __init__(self, budget=64*1024*1024):
+        self.budget = budget
+        self.size   = 0
+        self.hits   = 0
+        self.misses = 0
+        self.events = OrderedDict()
+
+    def __del__(self):
+        pass
+
+    def __len__(self):
+        return len(self.events)
+
+    def find(self, key):
+        # return (True, hits) if the event is cached, else (False, None)
+        try:
+            value = self.events.pop(key)
+        except KeyError:
+            self.misses += 1
+            return (False, None)
+        # mark as most recently used
+        self.events[key] = value
+        self.hits += 1
+        return (True, value)
+
+    def put(self, key, value):
+        if self.events.has_key(key):
+            self.size -= self.nbytes(self.events.pop(key))
+        size = self.nbytes(value)
+        if size > self.budget: return
+        self.events[key] = value
+        self.size += size
+        self.shrink()
+
+    def resize(self, budget):
+        self.budget = budget
+        self.shrink()
+
+    def clear(self):
+        self.events.clear()
+        self.size = 0
+
+    def shrink(self):
+        while self.size > self.budget:
+            key, value = self.events.popitem(last=False)
+            self.size -= self.nbytes(value)
+
+    def nbytes(self, value):
+        if value is None: return 0
+        return value.nbytes
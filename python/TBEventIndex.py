@@ -0,0 +1,128 @@
+#-----------------------------------------------------------------------------
+# File:        TBEventIndex.py
+# Description: TB 2016 per-event summaries of a run, used to jump to
+#              interesting events without reading the events in between
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, hashlib
+import numpy as np
+from HGCal.TBEventDisplay.TBUtil import *
+from HGCal.TBEventDisplay.TBGeometryCache import CACHEDIR
+#------------------------------------------------------------------------------
+def summaryType(nlayers):
+    # one record per event; per-layer quantities are indexed by layer-1
+    return np.dtype([('nhits',  np.int32),
+                     ('total',  np.float64),
+                     ('maxadc', np.float64, (nlayers,)),
+                     ('xc',     np.float64, (nlayers,)),
+                     ('yc',     np.float64, (nlayers,))])
+#------------------------------------------------------------------------------
+def summarize(hits, record):
+    # fill a summary record from the hit array of an event
+    record['nhits'] = 0
+    record['total'] = 0
+    record['maxadc'][:] = 0
+    record['xc'][:] = 0
+    record['yc'][:] = 0
+    if hits is None or len(hits) == 0: return
+
+    nlayers = len(record['maxadc'])
+    row = hits['layer'] - 1
+    ok  = (row >= 0) & (row < nlayers)
+    row = row[ok]
+    adc = hits['adc'][ok]
+    record['nhits'] = len(hits)
+    record['total'] = hits['adc'].sum()
+
+    maxadc = np.zeros(nlayers)
+    np.maximum.at(maxadc, row, adc)
+    record['maxadc'][:] = maxadc
+
+    # adc-weighted centroid per layer
+    sumw = np.bincount(row, weights=adc, minlength=nlayers)
+    sumx = np.bincount(row, weights=adc*hits['x'][ok], minlength=nlayers)
+    sumy = np.bincount(row, weights=adc*hits['y'][ok], minlength=nlayers)
+    w = np.where(sumw != 0, sumw, 1)
+    record['xc'][:] = sumx / w
+    record['yc'][:] = sumy / w
+#------------------------------------------------------------------------------
+class EventIndex:
+    # summaries of the events of a ROOT file, kept in a sidecar file
+    # <root-file>.index.npy next to it. The index of a chain of files is
+    # kept in the cache directory, under a hash of the file names. The
+    # sidecar is used only if it is newer than the ROOT files; an index
+    # of a file that has grown can be extended with update. Summaries
+    # depend on the decoder settings (HitDecoder.settings), so those made
+    # with settings other than the defaults are kept in sidecars of their
+    # own, named with a hash of the settings.
+
+    def __init__(self, files, nlayers, settings=''):
+        self.files    = files
+        if len(files) == 1:
+            suffix = ''
+            if settings:
+                suffix = '-%s' % hashlib.sha1(settings).hexdigest()[:12]
+            self.sidecar = '%s.index%s.npy' % (files[0], suffix)
+        else:
+            key = hashlib.sha1('\n'.join([os.path.abspath(f)
+                                          for f in files] +
+                                         [settings])).hexdigest()
+            self.sidecar = os.path.join(CACHEDIR, 'index-%s.npy' % key)
+        self.dtype    = summaryType(nlayers)
+        self.events   = np.zeros(0, self.dtype)
+        self.load()
+
+    def __del__(self):
+        pass
+
+    def __len__(self):
+        return len(self.events)
+
+    def load(self):
+        try:
+            if os.path.getmtime(self.sidecar) < \
+                    max([os.path.getmtime(f) for f in self.files]): return
+            events = np.load(self.sidecar)
+        except (IOError, OSError, ValueError):
+            return
+        if events.dtype == self.dtype:
+            self.events = events
+
+    def save(self):
+        try:
+            dirname = os.path.dirname(self.sidecar)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            np.save(self.sidecar, self.events)
+        except (IOError, OSError), message:
+            print '** EventIndex - unable to write %s: %s' % \
+                (self.sidecar, message)
+
+    def update(self, reader, decoder, nevents, progress=None):
+        # summarize events len(self) to nevents-1. progress, if given,
+        # is called with the event number after each event.
+        first = len(self.events)
+        if first >= nevents: return
+        events = np.zeros(nevents, self.dtype)
+        events[:first] = self.events
+        for number in xrange(first, nevents):
+            reader.read(number)
+            summarize(getHits(reader, decoder), events[number])
+            if progress: progress(number)
+        self.events = events
+        self.save()
+
+    def next(self, start, select):
+        # first event after start whose summary satisfies the boolean
+        # array select, or -1 if there is none
+        found = np.flatnonzero(select[start+1:])
+        if len(found) == 0: return -1
+        return start + 1 + int(found[0])
+
+    def nextTotalADC(self, start, threshold):
+        return self.next(start, self.events['total'] > threshold)
+
+    def nextLayersHit(self, start, nlayers, ADCmin=0):
+        # a layer is hit if its largest adc count is at least ADCmin
+        hit = (self.events['maxadc'] >= ADCmin) & (self.events['maxadc'] > 0)
+        return self.next(start, hit.sum(axis=1) >= nlayers)
@@ -0,0 +1,197 @@
+#-----------------------------------------------------------------------------
+# File:        TBEventStore.py
+# Description: TB 2016 compact memory-mapped store of the hits of a run,
+#              converted from SKIROC ROOT files
+#              (TBEventDisplay.py --convert ...)
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re, time, json, shutil, copy
+import numpy as np
+from argparse import ArgumentParser
+from HGCal.TBEventDisplay.TBUtil import *
+from HGCal.TBEventDisplay.TBFileChain import FileChain
+#------------------------------------------------------------------------------
+# change when the layout of a store changes
+STORE_VERSION = 2
+# one fixed-width record per hit. cell is the position of the cell in
+# the layer's cell table (cellmap.cells(layer) order); samples and low
+# hold the high- and low-gain adc counts of the first nsamples time
+# samples.
+RECORD_DTYPE = np.dtype([('layer',    np.int16),
+                         ('cell',     np.int16),
+                         ('adc',      np.float32),
+                         ('nsamples', np.int16),
+                         ('samples',  np.int16, (NSAMPLES,)),
+                         ('low',      np.int16, (NSAMPLES,))])
+#------------------------------------------------------------------------------
+# A store is a directory <name>.tbstore holding
+#   hits.bin      the records of all events, one after the other
+#   offsets.npy   nevents+1 offsets: the records of event n are
+#                 hits[offsets[n]:offsets[n+1]]
+#   meta.json     version, record layout and the files converted
+def isStore(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+#------------------------------------------------------------------------------
+class EventStore:
+    # reader of a store, used like TBFileReader: read(n) then
+    # store(keyname) gives the records of event n, a view of the
+    # memory-mapped file, which getHits turns into a hit array. Opening
+    # and reading copy nothing from disk beyond the pages touched.
+
+    def __init__(self, path):
+        self.path  = path
+        self.name  = path
+        meta = json.load(open(os.path.join(path, 'meta.json')))
+        if meta['version'] != STORE_VERSION:
+            raise IOError('%s: store version %s, expected %d' % \
+                              (path, meta['version'], STORE_VERSION))
+        self.meta    = meta
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'),
+                               mmap_mode='r')
+        if meta['hits'] > 0:
+            self.records = np.memmap(os.path.join(path, 'hits.bin'),
+                                     RECORD_DTYPE, 'r')
+        else:
+            self.records = np.zeros(0, RECORD_DTYPE)
+        # the sidecar files of the event index go in the store
+        self.files   = [os.path.join(path, 'hits.bin')]
+        self.counts  = np.array([self.entries()], np.int64)
+        self.current = self.records[0:0]
+
+    def __del__(self):
+        pass
+
+    def clone(self):
+        # the maps are read-only, so a clone shares them and has only
+        # its own current event
+        return copy.copy(self)
+
+    def entries(self):
+        return len(self.offsets) - 1
+
+    def read(self, eventNumber):
+        a = int(self.offsets[eventNumber])
+        b = int(self.offsets[eventNumber+1])
+        self.current = self.records[a:b]
+
+    def __call__(self, keyname):
+        return self.current
+
+    def refresh(self, nlast):
+        # a store does not grow
+        return 0
+
+    def close(self):
+        pass
+#------------------------------------------------------------------------------
+def openReader(files, counts=None):
+    # a store, or a chain of ROOT files
+    if isinstance(files, str): files = [files]
+    if len(files) == 1 and isStore(files[0]):
+        return EventStore(files[0])
+    return FileChain(files, counts)
+#------------------------------------------------------------------------------
+def convert(reader, decoder, output, keyname="SKIROC2DataFrame",
+            progress=None):
+    # write the hits of every event of reader (a FileChain) to the store
+    # output. The store is written under a temporary name and renamed
+    # when complete. Returns the number of hits not in a known cell,
+    # which are dropped.
+    table  = decoder.index
+    cellOf = -np.ones(table.size, np.int32)
+    cellOf[table.slots] = np.arange(len(table.slots))
+
+    tmp = '%s.tmp%d' % (output, os.getpid())
+    os.makedirs(tmp)
+    out = open(os.path.join(tmp, 'hits.bin'), 'wb')
+    nevents = reader.entries()
+    offsets = np.zeros(nevents+1, np.int64)
+    dropped = 0
+    for number in xrange(nevents):
+        reader.read(number)
+        try:
+            skiroc = reader(keyname)
+        except:
+            skiroc = None
+        if skiroc == None:
+            records = np.zeros(0, RECORD_DTYPE)
+            u = v = np.zeros(0, np.int32)
+        else:
+            # a store keeps every sample of both gains
+            layer, u, v, samples, low, nsamples = \
+                decoder.unpack(skiroc, NSAMPLES, True)
+            records = np.zeros(len(layer), RECORD_DTYPE)
+            records['layer']    = layer
+            records['samples']  = samples
+            records['low']      = low
+            records['nsamples'] = nsamples
+            records['adc']      = samples[:, 0]
+
+        slot = table.index(u, v)
+        cell = np.where(slot >= 0, cellOf[np.maximum(slot, 0)], -1)
+        ok   = cell >= 0
+        dropped += int((~ok).sum())
+        records['cell'] = cell
+        records = records[ok]
+        records.tofile(out)
+        offsets[number+1] = offsets[number] + len(records)
+        if progress: progress(number)
+    out.close()
+
+    np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+    meta = {'version':  STORE_VERSION,
+            'created':  time.strftime('%Y-%m-%d %H:%M:%S'),
+            'nsamples': NSAMPLES,
+            'dtype':    RECORD_DTYPE.descr,
+            'events':   nevents,
+            'hits':     int(offsets[-1]),
+            'files':    [os.path.abspath(f) for f in reader.files]}
+    json.dump(meta, open(os.path.join(tmp, 'meta.json'), 'w'), indent=1)
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.rename(tmp, output)
+    return dropped
+#------------------------------------------------------------------------------
+def main(argv):
+    from HGCal.TBEventDisplay.TBGeometryCache import loadGeometry
+    parser = ArgumentParser(prog='TBEventDisplay.py --convert',
+                            description='convert the SKIROC data frames '\
+                                'of a run to a memory-mapped hit store')
+    parser.add_argument('--convert', action='store_true',
+                        help='convert a run')
+    parser.add_argument('geometry', help='geometry file')
+    parser.add_argument('filename', nargs='+',
+                        help='root files of SKIROC data frames: files, '\
+                            'globs, run directories or text files '\
+                            'listing files')
+    parser.add_argument('--output', default=None,
+                        help='store to write (default: first file with '\
+                            '.root replaced by .tbstore)')
+    options = parser.parse_args(argv)
+
+    # need FWLite to read the data frames
+    from ROOT import gSystem, FWLiteEnabler
+    if gSystem.Load('libFWCoreFWLite') != 0:
+        sys.exit('**unable to load libFWCoreFWLite')
+    FWLiteEnabler.enable()
+
+    reader = FileChain(options.filename)
+    output = options.output
+    if output == None:
+        output = re.sub('[.]root$', '', reader.files[0]) + '.tbstore'
+
+    tables  = loadGeometry(options.geometry)
+    decoder = HitDecoder(tables['cells'], tables['geometry'],
+                         tables['sensitive'])
+    nevents = reader.entries()
+    t0 = time.time()
+    def progress(number):
+        if number % 1000 == 0:
+            print '%10d / %d' % (number, nevents)
+    dropped = convert(reader, decoder, output, progress=progress)
+    reader.close()
+    print 'converted %d events from %d file(s) to %s in %.1f s' % \
+        (nevents, len(reader.files), output, time.time()-t0)
+    if dropped > 0:
+        print '** %d hits not in a known cell were dropped' % dropped
+    return 0
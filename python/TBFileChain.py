@@ -0,0 +1,193 @@
+#-----------------------------------------------------------------------------
+# File:        TBFileChain.py
+# Description: TB 2016 the files of a run read as one sequence of events
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re, glob, cPickle
+import numpy as np
+from collections import OrderedDict
+from HGCal.TBEventDisplay.TBGeometryCache import CACHEDIR
+from HGCal.TBStandaloneSimulator.TBFileReader import TBFileReader
+from ROOT import *
+#------------------------------------------------------------------------------
+# largest number of files open at once
+POOLSIZE = 8
+#------------------------------------------------------------------------------
+def expandFiles(spec):
+    # spec: a string or a list of strings, each of which is a ROOT file,
+    # a glob, a directory (its .root files), a comma separated list of
+    # these, or a text file (.txt or .list) naming one file per line.
+    # Directories and globs are sorted; the order is otherwise kept.
+    if isinstance(spec, str): spec = [spec]
+    files = []
+    for item in spec:
+        for name in item.split(','):
+            name = name.strip()
+            if name == '': continue
+            if os.path.isdir(name):
+                files += sorted(glob.glob(os.path.join(name, '*.root')))
+            elif name[-4:] in ['.txt'] or name[-5:] in ['.list']:
+                lines = [x.strip() for x in open(name).readlines()]
+                files += expandFiles([x for x in lines
+                                      if x and x[0] != '#'])
+            elif re.search('[*?[]', name):
+                files += sorted(glob.glob(name))
+            else:
+                files.append(name)
+    return files
+#------------------------------------------------------------------------------
+def countEntries(filename, treename='Events'):
+    # number of events in a file, read from the tree's header. The
+    # current directory is restored when the context is deleted.
+    context = TDirectory.TContext()
+    f = TFile.Open(filename)
+    if f and not f.IsZombie():
+        tree = f.Get(treename)
+        if tree:
+            n = int(tree.GetEntries())
+            f.Close()
+            return n
+        f.Close()
+    reader = TBFileReader(filename)
+    n = reader.entries()
+    reader.file().Close()
+    return n
+#------------------------------------------------------------------------------
+def entryCounts(files, cachedir=CACHEDIR):
+    # number of events in each file. The counts are cached on disk,
+    # keyed by path, size and modification time, so that only new or
+    # changed files are opened.
+    filename = os.path.join(cachedir, 'entries.pkl')
+    try:
+        cache = cPickle.load(open(filename, 'rb'))
+    except Exception:
+        cache = {}
+
+    counts  = []
+    changed = False
+    for name in files:
+        path = os.path.abspath(name)
+        try:
+            st  = os.stat(path)
+            key = (st.st_size, st.st_mtime)
+        except OSError:
+            key = None
+        if key != None and cache.has_key(path) and cache[path][0] == key:
+            counts.append(cache[path][1])
+            continue
+        n = countEntries(name)
+        counts.append(n)
+        if key != None:
+            cache[path] = (key, n)
+            changed = True
+
+    if changed:
+        try:
+            if not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+            tmp = '%s.%d' % (filename, os.getpid())
+            cPickle.dump(cache, open(tmp, 'wb'), cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, filename)
+        except Exception, message:
+            print '** entryCounts - unable to write cache %s: %s' % \
+                (filename, message)
+    return counts
+#------------------------------------------------------------------------------
+class FileChain:
+    # reader of a list of files, used like TBFileReader: events are
+    # numbered 0 to entries()-1 across the files, in order. A file is
+    # opened when one of its events is first read, and at most poolsize
+    # files are kept open (least recently used ones are closed).
+    #
+    # A chain is not shared between threads; a worker gets a clone,
+    # which has the same files and counts but its own open files.
+
+    def __init__(self, files, counts=None, poolsize=POOLSIZE):
+        self.files = expandFiles(files)
+        if len(self.files) == 0:
+            raise IOError('no files found in %s' % files)
+        if counts is None:
+            counts = entryCounts(self.files)
+        self.setCounts(counts)
+        self.poolsize = max(1, poolsize)
+        self.pool     = OrderedDict()
+        self.current  = None
+        if len(self.files) == 1:
+            self.name = self.files[0]
+        else:
+            self.name = '%s (+%d files)' % (self.files[0],
+                                           len(self.files)-1)
+
+    def __del__(self):
+        pass
+
+    def setCounts(self, counts):
+        self.counts  = np.array(counts, np.int64)
+        self.offsets = np.zeros(len(self.counts)+1, np.int64)
+        self.offsets[1:] = np.cumsum(self.counts)
+
+    def clone(self):
+        return FileChain(self.files, self.counts, self.poolsize)
+
+    def entries(self):
+        return int(self.offsets[-1])
+
+    def locate(self, eventNumber):
+        # (file index, event number within the file)
+        ii = int(np.searchsorted(self.offsets, eventNumber, 'right')) - 1
+        return (ii, eventNumber - int(self.offsets[ii]))
+
+    def filename(self, eventNumber):
+        return self.files[self.locate(eventNumber)[0]]
+
+    def reader(self, ii):
+        # the reader of file ii, from the pool if it is open
+        if self.pool.has_key(ii):
+            reader = self.pool.pop(ii)
+        else:
+            # the file must not become the current directory
+            context = TDirectory.TContext()
+            reader  = TBFileReader(self.files[ii])
+            del context
+            while len(self.pool) >= self.poolsize:
+                self.closeReader(self.pool.popitem(last=False)[1])
+        self.pool[ii] = reader
+        return reader
+
+    def closeReader(self, reader):
+        if reader is self.current:
+            self.current = None
+        try:
+            reader.file().Close()
+        except:
+            pass
+
+    def read(self, eventNumber):
+        ii, number = self.locate(eventNumber)
+        self.current = self.reader(ii)
+        self.current.read(number)
+
+    def __call__(self, keyname):
+        return self.current(keyname)
+
+    def file(self):
+        return self.current.file()
+
+    def refresh(self, nlast):
+        # the last file now has nlast events (e.g. it is being written).
+        # Its reader is reopened on the next read. Returns the number of
+        # events added.
+        added = nlast - int(self.counts[-1])
+        if added == 0: return 0
+        counts = self.counts.copy()
+        counts[-1] = nlast
+        self.setCounts(counts)
+        ii = len(self.files) - 1
+        if self.pool.has_key(ii):
+            self.closeReader(self.pool.pop(ii))
+        return added
+
+    def close(self):
+        for reader in self.pool.values():
+            self.closeReader(reader)
+        self.pool.clear()
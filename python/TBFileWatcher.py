@@ -0,0 +1,85 @@
+#-----------------------------------------------------------------------------
+# File:        TBFileWatcher.py
+# Description: TB 2016 cheap polling of the number of events in a ROOT
+#              file that is being written
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, time
+from ROOT import *
+#------------------------------------------------------------------------------
+class FileWatcher:
+    # poll returns the number of entries of the file. It costs a stat of
+    # the file unless the file has changed, in which case the events tree
+    # is refreshed from the file (TTree::Refresh) on a handle kept open
+    # for that purpose. If the tree cannot be found, a TBFileReader is
+    # built to count the entries.
+
+    def __init__(self, filename, treename='Events'):
+        self.filename = filename
+        self.treename = treename
+        self.stamp    = None
+        self.file     = None
+        self.tree     = None
+        self.entries  = 0
+
+    def __del__(self):
+        pass
+
+    def poll(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return self.entries
+        stamp = (st.st_size, st.st_mtime)
+        if stamp == self.stamp: return self.entries
+        self.stamp = stamp
+
+        # opening a file makes it the current directory; restore the
+        # previous one afterwards, or histograms created later would
+        # belong to (and be deleted with) this file
+        context = TDirectory.TContext()
+        if self.tree == None:
+            self.file = TFile.Open(self.filename)
+            if self.file and not self.file.IsZombie():
+                tree = self.file.Get(self.treename)
+                if tree: self.tree = tree
+        else:
+            self.tree.Refresh()
+
+        if self.tree != None:
+            self.entries = int(self.tree.GetEntries())
+        else:
+            # imported here so that RateMeter does not need FWLite
+            from HGCal.TBStandaloneSimulator.TBFileReader import \
+                TBFileReader
+            reader = TBFileReader(self.filename)
+            self.entries = reader.entries()
+            reader.file().Close()
+        del context
+        return self.entries
+
+    def close(self):
+        if self.file: self.file.Close()
+        self.file = None
+        self.tree = None
+#------------------------------------------------------------------------------
+class RateMeter:
+    # events per second, averaged over about window seconds
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.count  = 0
+        self.start  = time.time()
+        self.rate   = 0.0
+
+    def __del__(self):
+        pass
+
+    def add(self, n=1):
+        self.count += n
+        now = time.time()
+        if now - self.start >= self.window:
+            self.rate  = self.count / (now - self.start)
+            self.count = 0
+            self.start = now
+        return self.rate
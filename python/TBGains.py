@@ -0,0 +1,62 @@
+#-----------------------------------------------------------------------------
+# File:        TBGains.py
+# Description: TB 2016 per-channel high/low gain calibration, used to
+#              replace saturated high-gain samples by scaled low-gain ones
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re
+import numpy as np
+from HGCal.TBEventDisplay.TBPedestals import NCHANNELS, channelKeys
+#------------------------------------------------------------------------------
+# used for channels not in the calibration file
+RATIO      = 10.0     # high gain / low gain
+SATURATION = 1800     # raw high-gain adc count at which it saturates
+#------------------------------------------------------------------------------
+class GainCalibration:
+    # ratio, low-gain pedestal and high-gain saturation of each
+    # (layer, skiroc, channel), in flat arrays indexed like Pedestals.
+    # The calibration file has one line per channel
+    #
+    #   layer skiroc channel ratio [low-gain-pedestal [saturation]]
+    #
+    # with # starting a comment.
+
+    def __init__(self, nlayers, nskiroc):
+        self.nlayers    = nlayers
+        self.nskiroc    = nskiroc
+        self.size       = (nlayers+1) * nskiroc * NCHANNELS
+        self.ratio      = RATIO * np.ones(self.size)
+        self.lowped     = np.zeros(self.size)
+        self.saturation = SATURATION * np.ones(self.size)
+
+    def __del__(self):
+        pass
+
+    def keys(self, layer, skiroc, channel):
+        return channelKeys(layer, skiroc, channel,
+                           self.nlayers, self.nskiroc)
+
+    def load(self, filename):
+        rows = []
+        for line in open(filename):
+            line = line.split('#')[0].strip()
+            if line == '': continue
+            fields = line.split()
+            if len(fields) < 4 or len(fields) > 6:
+                raise IOError('%s: bad line: %s' % (filename, line))
+            rows.append([float(x) for x in fields] + \
+                            [np.nan]*(6-len(fields)))
+        if len(rows) == 0: return
+        rows = np.array(rows)
+        keys = self.keys(rows[:, 0].astype(int), rows[:, 1].astype(int),
+                         rows[:, 2].astype(int))
+        ok   = keys >= 0
+        if not ok.all():
+            print '** GainCalibration - %d channels in %s not in the '\
+                'geometry' % ((~ok).sum(), filename)
+        keys, rows = keys[ok], rows[ok]
+        self.ratio[keys] = rows[:, 3]
+        given = ~np.isnan(rows[:, 4])
+        self.lowped[keys[given]] = rows[given, 4]
+        given = ~np.isnan(rows[:, 5])
+        self.saturation[keys[given]] = rows[given, 5]
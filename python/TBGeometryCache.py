@@ -0,0 +1,158 @@
+#-----------------------------------------------------------------------------
+# File:        TBGeometryCache.py
+# Description: TB 2016 processed geometry and cell tables, cached on disk
+#              and keyed by a hash of the geometry file, the modules it
+#              imports and the CMSSW release
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, ast, hashlib, cPickle
+import numpy as np
+from HGCal.TBStandaloneSimulator.TBGeometryUtil import *
+from ROOT import *
+#------------------------------------------------------------------------------
+# change when the content of the cache changes
+CACHE_VERSION = 2
+CACHEDIR = os.environ.get('TBEVENTDISPLAY_CACHE',
+                          os.path.join(os.environ.get('HOME', '.'),
+                                       '.cache', 'TBEventDisplay'))
+# the library with HGCCellMap, whose cell map is part of the key
+CELLMAPLIB = 'libHGCalTBStandaloneSimulator.so'
+#------------------------------------------------------------------------------
+def cellTable(cells, cellside):
+    # copy the cells of a layer (cellmap.cells(layer)) into arrays.
+    # The vertices of cell ii are xv[offset[ii]:offset[ii+1]], and
+    # likewise for yv.
+    n = cells.size()
+    table = {}
+    for name in ['u', 'v', 'skiroc', 'channel']:
+        table[name] = np.zeros(n, np.int32)
+    for name in ['x', 'y']:
+        table[name] = np.zeros(n)
+    xv = []
+    yv = []
+    offset = [0]
+    for ii in xrange(n):
+        cell = cells[ii]
+        table['u'][ii] = cell.u
+        table['v'][ii] = cell.v
+        table['x'][ii] = cell.x
+        table['y'][ii] = cell.y
+        table['skiroc'][ii]  = cell.skiroc
+        table['channel'][ii] = cell.channel
+        x, y = computeBinVertices(cellside, cell)
+        xv += list(x)
+        yv += list(y)
+        offset.append(len(xv))
+    table['xv'] = np.array(xv)
+    table['yv'] = np.array(yv)
+    table['offset'] = np.array(offset, np.int32)
+    return table
+#------------------------------------------------------------------------------
+def buildGeometry(geometryModule):
+    # the geometry, sensitive elements and cell tables of each layer
+    geometry  = createGeometry(geometry=geometryModule)
+    sensitive = geometry['sensitive']
+    geometry  = geometry['geometry']
+    cellmap   = HGCCellMap()
+    cells     = {}
+    # Note: in offline, layers start at 1
+    for l in xrange(len(sensitive)):
+        layer = l + 1
+        element = geometry[sensitive[layer]]
+        for key in ['cellsize', 'side', 'z']:
+            if not element.has_key(key):
+                sys.exit('** keyword %s not found - check %s' % \
+                             (key, geometryModule))
+        cells[layer] = cellTable(cellmap.cells(layer), element['cellsize'])
+    return {'geometry':  geometry,
+            'sensitive': sensitive,
+            'cells':     cells}
+#------------------------------------------------------------------------------
+def importedFiles(data):
+    # the source files of the modules imported by the geometry file
+    # (not those they import in turn). For "from a import b", b may be
+    # a module of package a.
+    try:
+        tree = ast.parse(data)
+    except SyntaxError:
+        return []
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and \
+                node.level == 0:
+            names.append(node.module)
+            names += ['%s.%s' % (node.module, alias.name)
+                      for alias in node.names]
+    files = []
+    for name in names:
+        try:
+            __import__(name)
+            filename = sys.modules[name].__file__
+        except Exception:
+            continue
+        if filename[-4:] in ['.pyc', '.pyo']:
+            filename = filename[:-1]
+        if filename not in files:
+            files.append(filename)
+    return sorted(files)
+
+def releaseKey():
+    # the CMSSW release and the build of the library with the cell map
+    # (HGCCellMap); empty outside CMSSW
+    key = [os.environ.get('CMSSW_VERSION', '')]
+    base = os.environ.get('CMSSW_BASE', '')
+    arch = os.environ.get('SCRAM_ARCH', '')
+    if base != '':
+        library = os.path.join(base, 'lib', arch, CELLMAPLIB)
+        try:
+            key.append('%s %d' % (library, os.stat(library).st_mtime))
+        except OSError:
+            pass
+    return '\n'.join(key)
+
+def geometryHash(geometryModule):
+    # None if the geometry is not given as a readable file. The hash
+    # covers the geometry file, the source of the modules it imports and
+    # the release (see releaseKey); a cell map file read at run time is
+    # not covered, so after editing one remove the cache (CACHEDIR).
+    try:
+        data = open(geometryModule, 'rb').read()
+    except IOError:
+        return None
+    sha = hashlib.sha1('%d\n%s\n' % (CACHE_VERSION, releaseKey()))
+    sha.update(data)
+    for filename in importedFiles(data):
+        try:
+            sha.update('\n%s\n' % filename)
+            sha.update(open(filename, 'rb').read())
+        except IOError:
+            pass
+    return sha.hexdigest()
+#------------------------------------------------------------------------------
+def loadGeometry(geometryModule, cachedir=CACHEDIR):
+    # return the tables of buildGeometry, from the cache if possible
+    key = geometryHash(geometryModule)
+    if key == None:
+        return buildGeometry(geometryModule)
+
+    filename = os.path.join(cachedir, 'geometry-%s.pkl' % key)
+    try:
+        return cPickle.load(open(filename, 'rb'))
+    except Exception:
+        pass
+
+    tables = buildGeometry(geometryModule)
+    try:
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        # write to a temporary file so that a reader never sees a
+        # partial cache
+        tmp = '%s.%d' % (filename, os.getpid())
+        cPickle.dump(tables, open(tmp, 'wb'), cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, filename)
+    except Exception, message:
+        print '** loadGeometry - unable to write cache %s: %s' % \
+            (filename, message)
+    return tables
@@ -5,7 +5,9 @@
 # Created:     10-Apr-2016 Jeremy Thomas, Harrison B. Prosper
 #-----------------------------------------------------------------------------
 import sys, os, re
+import numpy as np
 from string import atof, lower, replace, strip, split, joinfields, find
+from array import array
 from HGCal.TBEventDisplay.TBUtil import *
 from HGCal.TBStandaloneSimulator.TBGeometryUtil import *
 from math import *
@@ -17,7 +19,6 @@ class HeatMap:
         self.parent  = parent
         self.page    = page
         self.canvas  = page.canvas
-        self.cellmap = parent.cellmap
         self.hist    = parent.hist
 
         self.geometry  = parent.geometry
@@ -50,34 +51,100 @@ class HeatMap:
             self.wafer.Draw()
         self.canvas.Update()
 
+        # the first Draw replaces these with the pads' primitives
+        self.labels  = None
+        # per pad, a marker on each cell with a saturated hit and the
+        # number of cells marked
+        self.markers = []
+
     def __del__(self):
         pass
 
-    def Draw(self, parent):
-        if parent.hits == None: return
-
+    def drawPads(self, parent):
         gStyle.SetOptStat("")
-        self.text = TText()
-        self.text.SetTextSize(0.02)
-        self.text.SetTextAlign(22)  # centered
-
+        store = parent.store
+        # labels: for each labelled pad, one text per cell and the value
+        # it shows (-1 for none), and whether it is shown as saturated
+        self.labels = []
         for l, h in enumerate(self.hist):
             layer = l + 1
-            cells = parent.cells[layer]
-
             self.canvas.cd(layer)
             h.Draw("colz")
             self.wafer.Draw("same")
+            marker = TPolyMarker(0)
+            marker.SetMarkerStyle(24)     # open circle
+            marker.SetMarkerColor(kRed)
+            marker.SetMarkerSize(1.2)
+            marker.Draw()
+            self.markers.append([marker, 0])
             if len(self.hist) > 4: continue
 
-            for ii in xrange(cells.size()):
-                cell = cells[ii]
-                if cell.count < parent.ADCmin: continue
-                self.text.DrawText(cell.x, cell.y, "%d" % cell.count)
+            n = store.ncell[l]
+            texts = []
+            for ii in xrange(n):
+                text = TText(store.x[l, ii], store.y[l, ii], '')
+                text.SetTextSize(0.02)
+                text.SetTextAlign(22)  # centered
+                text.Draw()
+                texts.append(text)
+            self.labels.append((texts, -np.ones(n, int),
+                                np.zeros(n, np.bool_)))
+
+    def markSaturated(self, store, l):
+        # circle the cells of layer l+1 with a saturated hit
+        marker, shown = self.markers[l]
+        cells = np.flatnonzero(store.saturated[l, :store.ncell[l]])
+        if len(cells) == 0 and shown == 0: return
+        if len(cells) == 0:
+            marker.SetPolyMarker(0)
+        else:
+            marker.SetPolyMarker(len(cells),
+                                 array('d', store.x[l, cells].tolist()),
+                                 array('d', store.y[l, cells].tolist()))
+        self.markers[l][1] = len(cells)
+
+    def Draw(self, parent):
+        if parent.hits is None: return
+
+        # the histograms, wafer outlines and labels are put on the pads
+        # once; after that only their contents change, so the number of
+        # primitives on a pad stays fixed however many events are shown
+        if self.labels == None:
+            self.drawPads(parent)
+
+        store = parent.store
+        for l in xrange(len(self.hist)):
+            layer = l + 1
+            self.canvas.GetPad(layer).Modified()
+            self.markSaturated(store, l)
+            if l >= len(self.labels): continue
+
+            # update only the labels whose value has changed
+            count = store.count[l, :store.ncell[l]]
+            value = np.where(count >= parent.ADCmin, count, -1).astype(int)
+            sat   = store.saturated[l, :store.ncell[l]] & (value >= 0)
+            texts, shown, shownsat = self.labels[l]
+            changed = (value != shown) | (sat != shownsat)
+            for ii in np.flatnonzero(changed).tolist():
+                if value[ii] < 0:
+                    texts[ii].SetTitle('')
+                elif sat[ii]:
+                    # high gain saturated: value from the low gain
+                    texts[ii].SetTitle('%d*' % value[ii])
+                    texts[ii].SetTextColor(kRed)
+                else:
+                    texts[ii].SetTitle('%d' % value[ii])
+                    texts[ii].SetTextColor(kBlack)
+            shown[:]    = value
+            shownsat[:] = sat
 
+        start = parent.stages.mark()
         self.canvas.Update()
+        parent.stages.add('update', start)
 
         if parent.shutterOpen:
             filename = "heatmap%5.5d.png" % parent.eventNumber
+            start = parent.stages.mark()
             self.canvas.SaveAs(filename)
+            parent.stages.add('save', start)
 
@@ -17,7 +17,6 @@ class Lego:
         self.parent  = parent
         self.page    = page
         self.canvas  = page.canvas
-        self.cellmap = parent.cellmap        
         self.geometry  = parent.geometry
         self.sensitive = parent.sensitive
 
@@ -26,50 +25,39 @@ class Lego:
         self.nlayers = len(self.sensitive)
         self.nplots  = divideCanvas(self.nlayers, self.canvas)
 
-        # create honeycomb histograms
+        # create honeycomb histograms by copying the sensor histograms
+        # of the data cache, whose bins are already built
         self.hist = []
         for l in xrange(self.nplots):
             layer =  l + 1
-            element = self.geometry[self.sensitive[layer]]
-            if not element.has_key('cellsize'):
-                sys.exit('** TBLego - cellsize not found')
-            if not element.has_key('side'):
-                sys.exit('** TBLego - side not founds')
-
-            cellside= element['cellsize']
-            side    = element['side']
-            poly = TH2Poly()
-            poly.SetName('lego %3d' % layer)
+            poly = parent.hist[l].Clone('lego %3d' % layer)
             poly.SetTitle('lego %3d' % layer)
-            poly.GetXaxis().CenterTitle()
-            poly.GetXaxis().SetTitle("#font[12]{x} axis")
-            poly.GetYaxis().CenterTitle()
-            poly.GetYaxis().SetTitle("#font[12]{y} axis")
-
-            # populate histogram with cells
-            cells = parent.cells[layer]
-            for ii, cell in enumerate(cells):
-                xv, yv = computeBinVertices(cellside, cell)
-                poly.AddBin(len(xv), xv, yv)
+            poly.SetMinimum()
+            poly.SetMaximum()
             self.hist.append(poly)
 
     def __del__(self):
         pass
 
     def Draw(self, parent):
-        if parent.hits == None: return
+        if parent.hits is None: return
 
+        store = parent.store
         for l, h in enumerate(self.hist):
             layer = l + 1
-            cells = parent.cells[layer]
-            for ii, cell in enumerate(cells):
-                h.SetBinContent(ii+1, cell.count)
+            count = store.count[l, :store.ncell[l]]
+            for ii, c in enumerate(count.tolist()):
+                h.SetBinContent(ii+1, c)
             h.SetMaximum(parent.maxCount)
             self.canvas.cd(layer)
             h.Draw("legogl")
+        start = parent.stages.mark()
         self.canvas.Update()
+        parent.stages.add('update', start)
 
         if parent.shutterOpen:
             filename = "lego%5.5d.png" % parent.eventNumber
+            start = parent.stages.mark()
             self.canvas.SaveAs(filename)
+            parent.stages.add('save', start)
 
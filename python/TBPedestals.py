@@ -0,0 +1,154 @@
+#-----------------------------------------------------------------------------
+# File:        TBPedestals.py
+# Description: TB 2016 streaming per-channel pedestal and noise estimates
+#              (TBEventDisplay.py --pedestal-run ...)
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, re, time, threading
+import numpy as np
+from argparse import ArgumentParser
+#------------------------------------------------------------------------------
+NCHANNELS = 64
+#------------------------------------------------------------------------------
+def channelKeys(layer, skiroc, channel, nlayers, nskiroc):
+    # flat key (layer*nskiroc + skiroc)*NCHANNELS + channel of each
+    # channel, or -1 if out of range
+    ok = (layer >= 0) & (layer <= nlayers) & \
+        (skiroc >= 0) & (skiroc < nskiroc) & \
+        (channel >= 0) & (channel < NCHANNELS)
+    keys = (layer*nskiroc + skiroc)*NCHANNELS + channel
+    return np.where(ok, keys, -1)
+#------------------------------------------------------------------------------
+class Pedestals:
+    # mean and rms of the raw adc counts of each (layer, skiroc, channel),
+    # updated one batch of values at a time with the parallel form of
+    # Welford's algorithm (Chan et al.), so that a whole event is added
+    # with a few bincounts. The arrays are indexed by the flat key
+    # (layer*nskiroc + skiroc)*NCHANNELS + channel.
+    #
+    # Once a channel has warmup entries, only values within nsigma rms
+    # of its mean are added, so that estimates made on physics events
+    # are not pulled up by the signals.
+
+    def __init__(self, nlayers, nskiroc, nsigma=3.0, warmup=50):
+        self.nlayers = nlayers
+        self.nskiroc = nskiroc
+        self.nsigma  = nsigma
+        self.warmup  = warmup
+        self.size    = (nlayers+1) * nskiroc * NCHANNELS
+        self.n       = np.zeros(self.size, np.int64)
+        self.mean    = np.zeros(self.size)
+        self.m2      = np.zeros(self.size)
+        self.lock    = threading.Lock()
+
+    def __del__(self):
+        pass
+
+    def keys(self, layer, skiroc, channel):
+        return channelKeys(layer, skiroc, channel,
+                           self.nlayers, self.nskiroc)
+
+    def rms(self):
+        return np.sqrt(self.m2 / np.maximum(self.n - 1, 1))
+
+    def update(self, keys, adc):
+        # add the raw adc counts adc of the channels keys
+        self.lock.acquire()
+        try:
+            ok = keys >= 0
+            keys, adc = keys[ok], np.asarray(adc, np.float64)[ok]
+            # drop likely signals from channels already measured
+            ready = self.n[keys] >= self.warmup
+            far   = np.abs(adc - self.mean[keys]) > \
+                self.nsigma * self.rms()[keys]
+            keep  = ~(ready & far)
+            keys, adc = keys[keep], adc[keep]
+            if len(keys) == 0: return
+
+            # count, mean and sum of squared deviations of the batch
+            nb  = np.bincount(keys, minlength=self.size)
+            mb  = np.bincount(keys, weights=adc, minlength=self.size) / \
+                np.maximum(nb, 1)
+            m2b = np.bincount(keys, weights=(adc - mb[keys])**2,
+                              minlength=self.size)
+            hit = np.flatnonzero(nb)
+            nb, mb, m2b = nb[hit], mb[hit], m2b[hit]
+
+            # merge with the running estimates
+            na    = self.n[hit]
+            n     = na + nb
+            delta = mb - self.mean[hit]
+            self.mean[hit] += delta * nb / n
+            self.m2[hit]   += m2b + delta**2 * na * nb / n
+            self.n[hit]     = n
+        finally:
+            self.lock.release()
+
+    def save(self, filename):
+        np.savez(filename, n=self.n, mean=self.mean, m2=self.m2,
+                 shape=np.array([self.nlayers, self.nskiroc, NCHANNELS]))
+
+    def load(self, filename):
+        data  = np.load(filename)
+        shape = data['shape'].tolist()
+        if shape != [self.nlayers, self.nskiroc, NCHANNELS]:
+            raise IOError('%s: pedestals for %s (layers, skirocs, '\
+                              'channels), expected %s' % \
+                              (filename, shape, [self.nlayers,
+                                                 self.nskiroc, NCHANNELS]))
+        self.lock.acquire()
+        self.n    = data['n']
+        self.mean = data['mean']
+        self.m2   = data['m2']
+        self.lock.release()
+#------------------------------------------------------------------------------
+def main(argv):
+    # estimate the pedestals of every channel from a pedestal run
+    parser = ArgumentParser(prog='TBEventDisplay.py --pedestal-run',
+                            description='estimate the pedestal and noise '\
+                                'of every channel from a run')
+    parser.add_argument('--pedestal-run', action='store_true',
+                        help='run the pedestal estimation')
+    parser.add_argument('geometry', help='geometry file')
+    parser.add_argument('filename', nargs='+',
+                        help='root files of SKIROC data frames, or a '\
+                            'hit store')
+    parser.add_argument('--output', default='pedestals.npz',
+                        help='pedestal file to write')
+    parser.add_argument('--nsigma', type=float, default=3.0,
+                        help='ignore values more than this many rms from '\
+                            'the mean of a channel')
+    options = parser.parse_args(argv)
+
+    from ROOT import gSystem, FWLiteEnabler
+    if gSystem.Load('libFWCoreFWLite') != 0:
+        sys.exit('**unable to load libFWCoreFWLite')
+    FWLiteEnabler.enable()
+    from HGCal.TBEventDisplay.TBUtil import HitDecoder, getHits
+    from HGCal.TBEventDisplay.TBGeometryCache import loadGeometry
+    from HGCal.TBEventDisplay.TBEventStore import openReader
+
+    tables  = loadGeometry(options.geometry)
+    decoder = HitDecoder(tables['cells'], tables['geometry'],
+                         tables['sensitive'])
+    decoder.pedestals = decoder.newPedestals(options.nsigma)
+    decoder.learn     = True
+    decoder.subtract  = False
+    reader  = openReader(options.filename)
+    nevents = reader.entries()
+    t0 = time.time()
+    for number in xrange(nevents):
+        reader.read(number)
+        getHits(reader, decoder, learn=True)
+        if number % 1000 == 0:
+            print '%10d / %d' % (number, nevents)
+    reader.close()
+    decoder.pedestals.save(options.output)
+    p = decoder.pedestals
+    ok = p.n > 0
+    print 'pedestals of %d channels from %d events written to %s '\
+        'in %.1f s' % (ok.sum(), nevents, options.output, time.time()-t0)
+    if ok.any():
+        print 'mean pedestal %8.2f  mean noise %8.2f' % \
+            (p.mean[ok].mean(), p.rms()[ok].mean())
+    return 0
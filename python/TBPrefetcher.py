@@ -0,0 +1,79 @@
+#-----------------------------------------------------------------------------
+# File:        TBPrefetcher.py
+# Description: TB 2016 read-ahead of events for the event player
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, time, threading
+import ROOT
+from Queue import Queue, Empty, Full
+from HGCal.TBEventDisplay.TBUtil import *
+#------------------------------------------------------------------------------
+def enableThreads():
+    # the workers do ROOT I/O outside the GUI thread, so ROOT is made
+    # thread-safe (which also gives each thread its own gDirectory).
+    # The GUI thread must not hold the GIL while it waits in the event
+    # loop or paints a canvas, or the workers would run only while a slot
+    # is executing Python; the slots take the GIL back (see Slot.cc).
+    # Call before any worker is started.
+    ROOT.ROOT.EnableThreadSafety()
+    for method in [ROOT.TApplication.Run, ROOT.TCanvas.Update,
+                   ROOT.TCanvas.SaveAs]:
+        method._threaded = True
+#------------------------------------------------------------------------------
+class Prefetcher(threading.Thread):
+    # read and decode events first, first+step, first+2*step,... in a
+    # background thread. The worker uses its own file reader (a clone of
+    # the display's FileChain, not yet used by any thread) and hands
+    # the decoded events to the GUI thread as (eventNumber, hits, times)
+    # through a queue that holds at most depth events, where times are
+    # the read and decode times (s) of the event.
+
+    def __init__(self, reader, decoder, first, step, nevents, depth=10):
+        threading.Thread.__init__(self)
+        self.daemon   = True
+        self.reader   = reader
+        self.decoder  = decoder
+        self.first    = first
+        self.step     = step
+        self.nevents  = nevents
+        self.queue    = Queue(max(depth, 1))
+        self.stopped  = threading.Event()
+
+    def __del__(self):
+        pass
+
+    def run(self):
+        reader = self.reader
+        number = self.first
+        while 0 <= number < self.nevents:
+            start = time.time()
+            reader.read(number)
+            read  = time.time()
+            hits  = getHits(reader, self.decoder)
+            times = (read - start, time.time() - read)
+
+            # wait for room in the queue, but give up if asked to stop
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put((number, hits, times), True, 0.1)
+                    break
+                except Full:
+                    pass
+            if self.stopped.is_set(): break
+            number += self.step
+        reader.close()
+
+    def pop(self):
+        # next decoded event, or None if none is ready
+        try:
+            return self.queue.get_nowait()
+        except Empty:
+            return None
+
+    def done(self):
+        # true when the worker has finished and the queue is empty
+        return not self.is_alive() and self.queue.empty()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,95 @@
+#-----------------------------------------------------------------------------
+# File:        TBStageTimer.py
+# Description: TB 2016 per-stage latency statistics of the display chain
+# Created:     18-Oct-2026
+#-----------------------------------------------------------------------------
+import sys, os, time
+import numpy as np
+from collections import deque
+from HGCal.TBEventDisplay.TBFileWatcher import RateMeter
+#------------------------------------------------------------------------------
+# stages of the chain, in order. Each is timed exclusive of the stages
+# timed inside it: draw is a page's Draw less its canvas update and, for
+# snapshots, its save, so that the stages of an event add up to its
+# total time in the GUI and in batch alike.
+STAGES = ['read', 'decode', 'fill', 'draw', 'update', 'save']
+#------------------------------------------------------------------------------
+def writeTimings(filename, rows):
+    # one line per event: event number then the time (ms) of each stage
+    out = open(filename, 'w')
+    out.write('event,%s\n' % ','.join(STAGES))
+    for row in rows:
+        out.write('%d,%s\n' % (row[0],
+                               ','.join(['%.3f' % t for t in row[1:]])))
+    out.close()
+#------------------------------------------------------------------------------
+class StageTimer:
+    # time = stages.mark()
+    #   ...
+    # stages.add('read', time)
+    #
+    # A stage timed between mark() and add() is charged the time elapsed
+    # less that of the stages recorded in between.
+    #
+    # keeps the last window times of each stage for the statistics and
+    # the last maxrows events, one row per event, for the CSV dump. A
+    # stage is charged to the event opened by the last call to event().
+
+    def __init__(self, window=1000, maxrows=100000):
+        self.times = {}
+        for stage in STAGES:
+            self.times[stage] = deque(maxlen=window)
+        self.rows  = deque(maxlen=maxrows)
+        self.row   = None
+        self.rate  = RateMeter()
+        # total time recorded
+        self.spent = 0.0
+
+    def __del__(self):
+        pass
+
+    def mark(self):
+        return (time.time(), self.spent)
+
+    def add(self, stage, start):
+        # time since start, as returned by mark(), less the time of the
+        # stages recorded since
+        t0, spent = start
+        return self.record(stage, time.time() - t0 - (self.spent - spent))
+
+    def record(self, stage, seconds):
+        self.spent += seconds
+        self.times[stage].append(seconds)
+        if self.row != None:
+            self.row[1+STAGES.index(stage)] += 1000*seconds
+        return seconds
+
+    def event(self, eventNumber):
+        # start the row of a new event
+        self.row = [eventNumber] + [0.0]*len(STAGES)
+        self.rows.append(self.row)
+        self.rate.add(1)
+
+    def eventRate(self):
+        return self.rate.add(0)
+
+    def stats(self, stage):
+        # (count, mean, p50, p95, p99) in ms
+        t = 1000*np.array(self.times[stage])
+        if len(t) == 0: return (0, 0.0, 0.0, 0.0, 0.0)
+        p50, p95, p99 = np.percentile(t, [50, 95, 99])
+        return (len(t), t.mean(), p50, p95, p99)
+
+    def summary(self):
+        lines = ['%-8s %8s %9s %9s %9s %9s' % \
+                     ('stage', 'count', 'mean', 'p50', 'p95', 'p99')]
+        for stage in STAGES:
+            n, mean, p50, p95, p99 = self.stats(stage)
+            if n == 0: continue
+            lines.append('%-8s %8d %9.2f %9.2f %9.2f %9.2f' % \
+                             (stage, n, mean, p50, p95, p99))
+        lines.append('events/s: %8.2f' % self.eventRate())
+        return '\n'.join(lines)
+
+    def dump(self, filename):
+        writeTimings(filename, self.rows)
@@ -3,47 +3,491 @@
 # Description: TB 2016 simple HGC test beam event display utilities
 # Created:     10-Apr-2016 Jeremy Thomas, Harrison B. Prosper
 #-----------------------------------------------------------------------------
-import sys, os, re
+import sys, os, re, hashlib
+import numpy as np
 from string import atof, lower, replace, strip, split, joinfields, find
 from array import array
 from math import *
 from ROOT import *
+from HGCal.TBEventDisplay.TBPedestals import Pedestals, channelKeys
+from HGCal.TBEventDisplay.TBGains import GainCalibration
 #------------------------------------------------------------------------------
-def getColor(y, ymax):
-    f  = float(min(y, ymax))/ymax
-    ii = int(0.99*f*TColor.GetNumberOfColors())
-    return TColor.GetColorPalette(ii)
+# columns of the hit array returned by getHits (one row per digi)
+HIT_DTYPE = np.dtype([('layer', np.int32),
+                      ('u',     np.int32),
+                      ('v',     np.int32),
+                      ('x',     np.float64),
+                      ('y',     np.float64),
+                      ('z',     np.float64),
+                      ('adc',   np.float64),
+                      # pulse quantities (see pulseShape); adc is the
+                      # one chosen by HitDecoder.quantity. NaN if only
+                      # the first sample was read.
+                      ('peak',     np.float64),
+                      ('integral', np.float64),
+                      ('time',     np.float64),
+                      # high gain saturated in some sample
+                      ('saturated', np.bool_)])
+
+# largest number of time samples read per digi, and their spacing (ns)
+NSAMPLES   = 16
+SAMPLETIME = 25.0
+# quantities that can be shown as the adc count of a hit
+QUANTITIES = ['sample0', 'peak', 'integral', 'time']
+#------------------------------------------------------------------------------
+def pulseShape(samples, nsamples):
+    # samples: (hits x NSAMPLES) adc counts, of which the first nsamples
+    # of each hit are read out. Returns, per hit, the sample of the
+    # peak, its adc count, the sum of the samples and the time (ns) of
+    # the peak, refined by a parabola through the peak sample and its
+    # neighbours.
+    n, width = samples.shape
+    if n == 0:
+        return (np.zeros(0, np.int32), np.zeros(0), np.zeros(0), np.zeros(0))
+    valid = np.arange(width)[None, :] < nsamples[:, None]
+    s     = np.where(valid, samples, -np.inf)
+    rows  = np.arange(n)
+    peaksample = s.argmax(axis=1)
+    peak  = s[rows, peaksample]
+    peak[nsamples == 0] = 0
+    integral = np.where(valid, samples, 0).sum(axis=1)
+
+    # neighbours of the peak; a peak in the first or last sample read
+    # is not refined
+    inner = (peaksample > 0) & (peaksample < nsamples-1)
+    prev  = np.where(inner, s[rows, np.maximum(peaksample-1, 0)], peak)
+    next  = np.where(inner, s[rows, np.minimum(peaksample+1, width-1)], peak)
+    curve = prev - 2*peak + next
+    fit   = inner & (curve < 0)
+    shift = np.where(fit, 0.5*(prev - next)/np.where(fit, curve, -1), 0)
+    time  = (peaksample + shift) * SAMPLETIME
+    return (peaksample.astype(np.int32), peak, integral, time)
+#------------------------------------------------------------------------------
+class ColorTable:
+    # colour index of the current palette for values in [0, ymax]. The
+    # palette is copied into an array on first use and again only when
+    # update is called, which whoever changes the palette
+    # (gStyle.SetPalette) must do, so that a whole array of values is
+    # mapped to colours with one lookup and no call into ROOT.
+
+    def __init__(self):
+        self.palette = None
+
+    def __del__(self):
+        pass
+
+    def update(self):
+        n = TColor.GetNumberOfColors()
+        self.palette = np.array([TColor.GetColorPalette(ii)
+                                 for ii in xrange(n)], np.int32)
+        return self.palette
+
+    def colors(self, y, ymax):
+        # colour index of each value of the array y
+        palette = self.palette
+        if palette is None:
+            palette = self.update()
+        if len(palette) == 0: return np.zeros(np.shape(y), np.int32)
+        f  = np.minimum(np.asarray(y, np.float64), ymax) / float(ymax)
+        ii = np.clip((0.99*f*len(palette)).astype(np.int32),
+                     0, len(palette)-1)
+        return palette[ii]
+
+# shared by everything that colours hits
+colorTable = ColorTable()
+#------------------------------------------------------------------------------
+class CellIndex:
+    # map cell coordinates (u, v) to the slot of a dense (u, v) table so
+    # that cell lookups can be done with array indexing
+
+    def __init__(self, u, v):
+        self.u = np.asarray(u, np.int32)
+        self.v = np.asarray(v, np.int32)
+        self.umin = int(self.u.min())
+        self.vmin = int(self.v.min())
+        self.nu   = int(self.u.max()) - self.umin + 1
+        self.nv   = int(self.v.max()) - self.vmin + 1
+        self.size = self.nu * self.nv
+        # slot of each cell, in cell order
+        self.slots = self.index(self.u, self.v)
+
+    def __del__(self):
+        pass
+
+    def index(self, u, v):
+        # slot of each (u, v) pair, or -1 if it is outside the table
+        iu = np.asarray(u) - self.umin
+        iv = np.asarray(v) - self.vmin
+        ok = (iu >= 0) & (iu < self.nu) & (iv >= 0) & (iv < self.nv)
+        return np.where(ok, iu * self.nv + iv, -1)
 #------------------------------------------------------------------------------
-def getHits(parent, cellmap, sensitive, keyname="SKIROC2DataFrame"):
+class HitDecoder:
+    # decode a SKIROC collection into a HIT_DTYPE array. The geometry
+    # tables are built once, so the only per-digi work left in Python is
+    # pulling the raw numbers out of each data frame.
+
+    def __init__(self, cells, geometry, sensitive):
+        # cells: per-layer cell tables (see TBGeometryCache). The cell map is
+        # needed only for cells missing from the tables.
+        self.cellmap = None
+
+        # layer -> z of sensitive element
+        # status: 0 = ok, -1 = layer not in geometry, 1 = sensitive
+        # element beyond the end of the geometry
+        size = max(sensitive.keys()) + 1
+        self.zlayer = np.zeros(size)
+        self.status = -np.ones(size, np.int32)
+        for layer, ii in sensitive.items():
+            if ii > len(geometry)-1:
+                self.status[layer] = 1
+            else:
+                self.status[layer] = 0
+                self.zlayer[layer] = geometry[ii]['z']
+
+        # (u, v) -> (x, y). The cells are the same for every layer.
+        table = cells[1]
+        self.index  = CellIndex(table['u'], table['v'])
+        self.xtable = np.zeros(self.index.size)
+        self.ytable = np.zeros(self.index.size)
+        self.known  = np.zeros(self.index.size, np.bool_)
+        slots = self.index.slots
+        self.xtable[slots] = table['x']
+        self.ytable[slots] = table['y']
+        self.known[slots]  = True
+        # cell -> (u, v), for hits given by cell (see TBEventStore)
+        self.ucell  = np.asarray(table['u'], np.int32)
+        self.vcell  = np.asarray(table['v'], np.int32)
+        # (u, v) -> readout (skiroc, channel)
+        self.nlayers = max(sensitive.keys())
+        self.nskiroc = int(table['skiroc'].max()) + 1
+        self.sktable = -np.ones(self.index.size, np.int32)
+        self.chtable = -np.ones(self.index.size, np.int32)
+        self.sktable[slots] = table['skiroc']
+        self.chtable[slots] = table['channel']
+
+        # pedestals (see TBPedestals): if set, the mean of each channel
+        # is subtracted and hits less than ksigma times its rms above
+        # it are dropped. If learn is set, the raw counts of the hits
+        # of the events decoded with learn=True (see getHits) update
+        # the pedestals; those decoded for other reasons (read ahead,
+        # indexed, accumulated) do not.
+        self.pedestals = None
+        self.learn     = False
+        self.subtract  = True
+        self.ksigma    = 3.0
+        # pulse quantity stored as the adc count of each hit
+        self.quantity  = 'sample0'
+        # gain calibration (see TBGains): if set, saturated high-gain
+        # samples are replaced by scaled low-gain ones
+        self.gains     = None
+        # wraps each element of a SKIROC collection (the benchmark
+        # replaces it to decode synthetic frames). Looked up when first
+        # needed, so that the dictionary is not needed otherwise.
+        self.frame  = None
+
+    def __del__(self):
+        pass
+
+    def newPedestals(self, nsigma=3.0):
+        # empty pedestals for the channels of this geometry
+        return Pedestals(self.nlayers, self.nskiroc, nsigma)
+
+    def newGains(self):
+        # default gain calibration for the channels of this geometry
+        return GainCalibration(self.nlayers, self.nskiroc)
+
+    def settings(self):
+        # key of the settings that change the decoded hits ('' for the
+        # defaults), e.g. to keep apart event summaries made with other
+        # settings
+        parts = []
+        if self.quantity != 'sample0':
+            parts.append(self.quantity)
+        p = self.pedestals
+        if p is not None and self.subtract:
+            digest = hashlib.sha1(p.mean.tostring() + p.rms().tostring() +
+                                  (p.n > 1).tostring()).hexdigest()
+            parts.append('pedestals:%s:%g' % (digest, self.ksigma))
+        g = self.gains
+        if g is not None:
+            digest = hashlib.sha1(g.ratio.tostring() + g.lowped.tostring() +
+                                  g.saturation.tostring()).hexdigest()
+            parts.append('gains:%s' % digest)
+        return ','.join(parts)
+
+    def samplesNeeded(self):
+        # the first sample is all the default quantity needs, unless
+        # saturated samples are merged with the low gain
+        if self.quantity == 'sample0' and self.gains is None: return 1
+        return NSAMPLES
+
+    def unpack(self, skiroc, nread=None, readLow=None):
+        # the raw numbers of each digi: layer, u, v, the high- and
+        # low-gain adc counts of its samples (hits x NSAMPLES each) and
+        # its number of samples. This is the only per-digi work done in
+        # Python, and each sample read costs three calls, so only the
+        # first nread samples (default: samplesNeeded()) are read, and
+        # the low gain only if readLow (default: if gains are set).
+        if nread is None: nread = self.samplesNeeded()
+        if readLow is None: readLow = self.gains is not None
+        n = skiroc.size()
+        layer    = np.zeros(n, np.int32)
+        u        = np.zeros(n, np.int32)
+        v        = np.zeros(n, np.int32)
+        samples  = np.zeros((n, NSAMPLES))
+        low      = np.zeros((n, NSAMPLES))
+        nsamples = np.zeros(n, np.int32)
+        if self.frame is None:
+            self.frame = SKIROC2DataFrame
+        frame = self.frame
+        for ii in xrange(n):
+            digi  = frame(skiroc[ii])
+            detid = digi.detid()
+            layer[ii] = detid.layer()
+            u[ii]     = detid.iu()
+            v[ii]     = detid.iv()
+            ns = min(digi.samples(), nread)
+            nsamples[ii] = ns
+            high = samples[ii]
+            if readLow:
+                lowg = low[ii]
+                for s in xrange(ns):
+                    sample  = digi[s]
+                    high[s] = sample.adcHigh()
+                    lowg[s] = sample.adcLow()
+            else:
+                for s in xrange(ns):
+                    high[s] = digi[s].adcHigh()
+        return (layer, u, v, samples, low, nsamples)
+
+    def decode(self, skiroc, learn=False):
+        nread = self.samplesNeeded()
+        layer, u, v, samples, low, nsamples = self.unpack(skiroc, nread)
+        hits = np.zeros(len(layer), HIT_DTYPE)
+        hits['layer'] = layer
+        hits['u']     = u
+        hits['v']     = v
+        hits = self.complete(hits, samples, low, nsamples, learn)
+        if nread < NSAMPLES:
+            # the pulse quantities of the first sample alone are not
+            # those of the pulse
+            for name in ['peak', 'integral', 'time']:
+                hits[name] = np.nan
+        return hits
+
+    def decodeRecords(self, records, learn=False):
+        # hits from the records of an event store, whose cells are
+        # given by their position in the cell table
+        hits = np.zeros(len(records), HIT_DTYPE)
+        cell = records['cell']
+        hits['layer'] = records['layer']
+        hits['u']     = self.ucell[cell]
+        hits['v']     = self.vcell[cell]
+        return self.complete(hits, records['samples'].astype(np.float64),
+                             records['low'].astype(np.float64),
+                             records['nsamples'].astype(np.int32), learn)
+
+    def complete(self, hits, samples, low, nsamples, learn=False):
+        # fill in z and (x, y) from the layer and (u, v) of each hit,
+        # then the adc counts from the samples
+        if len(hits) == 0: return hits
+        layer = hits['layer']
+        u     = hits['u']
+        v     = hits['v']
+
+        # check that every layer in the data is in the geometry
+        inrange = (layer >= 0) & (layer < len(self.status))
+        status  = np.where(inrange,
+                           self.status[np.where(inrange, layer, 0)], -1)
+        if (status < 0).any():
+            l = layer[status < 0][0]
+            sys.exit("\n**getHits-sensitive layer %d not found in geometry" % l)
+        if (status > 0).any():
+            sys.exit("\n**getHits-number of sensitive layers in geometry\n"\
+                         "   less than number in data!\n")
+        hits['z'] = self.zlayer[layer]
+
+        # (u, v) -> (x, y)
+        slot  = self.index.index(u, v)
+        found = slot >= 0
+        found[found] = self.known[slot[found]]
+        hits['x'][found] = self.xtable[slot[found]]
+        hits['y'][found] = self.ytable[slot[found]]
+
+        # cells missing from the table (should not happen)
+        for ii in np.flatnonzero(~found):
+            if self.cellmap == None:
+                self.cellmap = HGCCellMap()
+            xy = self.cellmap.uv2xy(int(u[ii]), int(v[ii]))
+            hits['x'][ii] = xy.first
+            hits['y'][ii] = xy.second
+        return self.process(hits, slot, samples, low, nsamples, learn)
+
+    def process(self, hits, slot, samples, low, nsamples, learn=False):
+        # pedestal subtraction, gain merging, pulse quantities and zero
+        # suppression, as array operations over all hits
+        p = self.pedestals
+        g = self.gains
+        suppress = p is not None and self.subtract
+        if p is not None or g is not None:
+            s    = np.maximum(slot, 0)
+            keys = channelKeys(hits['layer'],
+                               np.where(slot >= 0, self.sktable[s], -1),
+                               np.where(slot >= 0, self.chtable[s], -1),
+                               self.nlayers, self.nskiroc)
+        if g is not None:
+            # high gain saturated, in the samples read out
+            kg    = np.maximum(keys, 0)
+            valid = np.arange(NSAMPLES)[None, :] < nsamples[:, None]
+            saturated = valid & (keys >= 0)[:, None] & \
+                (samples >= g.saturation[kg][:, None])
+            hits['saturated'] = saturated.any(axis=1)
+        if p is not None:
+            # pedestals are estimated from the first sample
+            if learn and self.learn:
+                p.update(keys, samples[:, 0])
+            if suppress:
+                # channels without an estimate are left alone
+                k = np.maximum(keys, 0)
+                measured = (keys >= 0) & (p.n[k] > 1)
+                samples  = samples - \
+                    np.where(measured, p.mean[k], 0)[:, None]
+        if g is not None:
+            # scaled low gain, without its pedestal, where saturated
+            scaled  = (low - g.lowped[kg][:, None]) * g.ratio[kg][:, None]
+            samples = np.where(saturated, scaled, samples)
+
+        peaksample, peak, integral, time = pulseShape(samples, nsamples)
+        hits['peak']     = peak
+        hits['integral'] = integral
+        hits['time']     = time
+        if   self.quantity == 'peak':     hits['adc'] = peak
+        elif self.quantity == 'integral': hits['adc'] = integral
+        elif self.quantity == 'time':     hits['adc'] = time
+        else:                             hits['adc'] = samples[:, 0]
+
+        if suppress:
+            # on the first sample, as the pedestals are, whatever the
+            # quantity shown, so that the hits kept do not depend on it
+            keep = ~measured | (samples[:, 0] > self.ksigma * p.rms()[k])
+            hits = hits[keep]
+        return hits
+#------------------------------------------------------------------------------
+def getHits(reader, decoder, keyname="SKIROC2DataFrame", learn=False):
+    # learn: the hits may update the decoder's pedestals (if its learn
+    # is set). Only the thread that owns the pedestals may pass True.
     try:
-        skiroc = parent.reader(keyname)
+        skiroc = reader(keyname)
     except:
         return None
+    # an event store gives records, not data frames
+    if isinstance(skiroc, np.ndarray):
+        return decoder.decodeRecords(skiroc, learn)
+    return decoder.decode(skiroc, learn)
+#------------------------------------------------------------------------------
+class CellStore:
+    # per-cell state shared by the display pages. Every array is indexed
+    # by (layer-1, cell), with the cells of a layer in cellmap.cells(layer)
+    # order, so that cell ii is bin ii+1 of the layer's TH2Poly. Rows are
+    # padded to the largest layer; ncell gives the number of cells per
+    # layer. The arrays are read-only; counts (and the saturated flags)
+    # change only through add and reset, which are called by the data
+    # cache.
 
-    hits = {}
-    for ii in xrange(skiroc.size()):
-        digi = SKIROC2DataFrame(skiroc[ii])
-        nsamples = digi.samples()
-        detid    = digi.detid()
-        sensor_u = detid.sensorIU()
-        sensor_v = detid.sensorIV()
-        l  = detid.layer()
-        u  = detid.iu()
-        v  = detid.iv()
-        xy = cellmap.uv2xy(u, v)
-        x  = xy.first
-        y  = xy.second
-        ii =-1
-        if sensitive.has_key(l):
-            ii = sensitive[l]
-            if ii > len(parent.geometry)-1:
-                sys.exit("\n**getHits-number of sensitive layers in geometry\n"\
-                             "   less than number in data!\n")
-        else:
-            sys.exit("\n**getHits-sensitive layer %d not found in geometry" % l)
+    def __init__(self, cells, geometry, sensitive, index):
+        self.index   = index
+        self.nlayers = len(sensitive)
+        self.ncell   = np.array([len(cells[l+1]['u'])
+                                 for l in xrange(self.nlayers)], np.int32)
+        self.ncells  = int(self.ncell.max())
+        shape = (self.nlayers, self.ncells)
+
+        self.x       = np.zeros(shape)
+        self.y       = np.zeros(shape)
+        self.z       = np.zeros(shape)
+        self.u       = np.zeros(shape, np.int32)
+        self.v       = np.zeros(shape, np.int32)
+        self.skiroc  = np.zeros(shape, np.int32)
+        self.channel = np.zeros(shape, np.int32)
+        self._count  = np.zeros(shape)
+        # some hit of the cell had a saturated high gain
+        self._saturated = np.zeros(shape, np.bool_)
+
+        # (layer-1, (u, v) slot) -> flat key (layer-1)*ncells + cell,
+        # or -1 if there is no such cell
+        self.table = -np.ones((self.nlayers, index.size), np.int64)
+
+        for l in xrange(self.nlayers):
+            layer = l + 1
+            table = cells[layer]
+            n = self.ncell[l]
+            self.z[l, :n] = geometry[sensitive[layer]]['z']
+            for name in ['x', 'y', 'u', 'v', 'skiroc', 'channel']:
+                getattr(self, name)[l, :n] = table[name]
+            slots = index.index(self.u[l, :n], self.v[l, :n])
+            keys  = l * self.ncells + np.arange(n)
+            self.table[l, slots[slots >= 0]] = keys[slots >= 0]
+
+        for a in [self.x, self.y, self.z, self.u, self.v,
+                  self.skiroc, self.channel, self.table]:
+            a.flags.writeable = False
+        self.count = self._count.view()
+        self.count.flags.writeable = False
+        self.saturated = self._saturated.view()
+        self.saturated.flags.writeable = False
+
+    def __del__(self):
+        pass
 
-        z  = parent.geometry[ii]['z']
-        adc= digi[0].adcHigh()
-        if not hits.has_key(l): hits[l] = []
-        hits[l].append((adc, u, v, x, y, z))
-    return hits
+    def keys(self, hits):
+        # flat key of the cell of each hit, or -1 if the hit is not
+        # in a known cell
+        keys = -np.ones(len(hits), np.int64)
+        slot = self.index.index(hits['u'], hits['v'])
+        row  = hits['layer'] - 1
+        ok   = (slot >= 0) & (row >= 0) & (row < self.nlayers)
+        keys[ok] = self.table[row[ok], slot[ok]]
+        return keys
+
+    def add(self, hits):
+        # add the adc counts of the hits to the cell counts, summing hits
+        # that share a cell. Returns the keys of the cells that were filled.
+        keys = self.keys(hits)
+        ok   = keys >= 0
+        keys, inverse = np.unique(keys[ok], return_inverse=True)
+        self._count.flat[keys] += np.bincount(inverse,
+                                              weights=hits['adc'][ok])
+        self._saturated.flat[keys] |= \
+            np.bincount(inverse, weights=hits['saturated'][ok]) > 0
+        return keys
+
+    def addCounts(self, counts, saturated=None):
+        # add a flat array of counts, one per key, to the cell counts,
+        # and mark the cells flagged in saturated. Returns the keys of
+        # the cells that were filled.
+        keys = np.flatnonzero(counts)
+        self._count.flat[keys] += counts[keys]
+        if saturated is not None:
+            marked = np.flatnonzero(saturated)
+            self._saturated.flat[marked] = True
+            keys = np.union1d(keys, marked)
+        return keys
+
+    def reset(self, keys):
+        self._count.flat[keys] = 0
+        self._saturated.flat[keys] = False
+#------------------------------------------------------------------------------
+def decodeEventList(spec, nevents):
+    # "0-499", "3,7,12" or a mix such as "0-9,20,30-39"; ranges are
+    # inclusive. An empty spec means all events.
+    if not spec: return range(nevents)
+    events = []
+    for field in spec.split(','):
+        field = field.strip()
+        if field == '': continue
+        if '-' in field:
+            first, last = field.split('-')
+            events += range(int(first), int(last)+1)
+        else:
+            events.append(int(field))
+    return [n for n in events if 0 <= n < nevents]
@@ -142,6 +142,11 @@ class ProgressBar(TGHProgressBar):
 
      def __del__(self):
           pass
+
+     def Track(self, done, total):
+          # show the progress of a job of total steps
+          self.SetRange(0, max(total, 1))
+          self.SetPosition(done)
 #-----------------------------------------------------------------------------
 buttonNumber=-1
 class TextButton(TGTextButton):
@@ -264,7 +269,7 @@ class NoteBook(TGTab):
 	def __del__(self):
 		pass
 
-	def Add(self, name, sidebar=None):
+	def Add(self, name, sidebar=None, lazy=False):
 		self.number += 1
 		self.names[name] = self.number
 		self.pages[self.number] = Element()
@@ -273,7 +278,20 @@ class NoteBook(TGTab):
 		
 		element.name   = name
 		element.redraw = True
+		element.key    = None   # inputs of the last draw of the page
 		element.tab    = self.AddTab(name)
+		element.sidebarCode = sidebar
+		element.built  = False
+
+		# a lazy page gets its frames and canvas when first built
+		if not lazy:
+			self.Build(name)
+
+	def Build(self, name):
+		element = self.pages[self.names[name]]
+		if element.built: return
+		element.built = True
+		sidebar = element.sidebarCode
                 # structure
                 # +---+------------------+
                 # |+--++----------------+|
@@ -343,6 +361,10 @@ class NoteBook(TGTab):
                      gEve.AddElement(element.fixedelements)
                      gEve.AddElement(element.elements)
 
+		# needed if the page is built after the window is mapped
+		element.tab.MapSubwindows()
+		element.tab.Layout()
+
 	def SetPage(self, idd):
 
 		# Before changing current tab's color,
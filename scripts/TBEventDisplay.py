@@ -6,17 +6,44 @@
 #              (adapted from TB 2014 display by Sam Bein & HBP)
 #-----------------------------------------------------------------------------
 import sys, os, re, time, platform
+import numpy as np
+#------------------------------------------------------------------------------
+# headless rendering (TBEventDisplay.py --batch ...) must not start the GUI
+if '--batch' in sys.argv[1:]:
+    from HGCal.TBEventDisplay.TBBatch import main as batchMain
+    sys.exit(batchMain(sys.argv[1:]))
+# timing of synthetic events (TBEventDisplay.py --benchmark ...)
+if '--benchmark' in sys.argv[1:]:
+    from HGCal.TBEventDisplay.TBBenchmark import main as benchmarkMain
+    sys.exit(benchmarkMain(sys.argv[1:]))
+# pedestals from a pedestal run (TBEventDisplay.py --pedestal-run ...)
+if '--pedestal-run' in sys.argv[1:]:
+    from HGCal.TBEventDisplay.TBPedestals import main as pedestalMain
+    sys.exit(pedestalMain(sys.argv[1:]))
+# conversion of a run to a hit store (TBEventDisplay.py --convert ...)
+if '--convert' in sys.argv[1:]:
+    from HGCal.TBEventDisplay.TBEventStore import main as convertMain
+    sys.exit(convertMain(sys.argv[1:]))
+#------------------------------------------------------------------------------
 from time import ctime, sleep
 from array import array
 from HGCal.TBEventDisplay.Util import *
 from HGCal.TBEventDisplay.TBUtil import *
+from HGCal.TBEventDisplay.TBDataCache import DataCache
 
 from HGCal.TBEventDisplay.TBADCCounts import ADCCounts
 from HGCal.TBEventDisplay.TBHeatMap import HeatMap
 from HGCal.TBEventDisplay.TBLego import Lego
 from HGCal.TBEventDisplay.TBDisplay3D import Display3D
+from HGCal.TBEventDisplay.TBPrefetcher import Prefetcher, enableThreads
+from HGCal.TBEventDisplay.TBEventCache import EventCache
+from HGCal.TBEventDisplay.TBEventIndex import EventIndex
+from HGCal.TBEventDisplay.TBAccumulator import Accumulator
+from HGCal.TBEventDisplay.TBFileWatcher import FileWatcher, RateMeter
+from HGCal.TBEventDisplay.TBStageTimer import STAGES
+from HGCal.TBEventDisplay.TBFileChain import FileChain, expandFiles
+from HGCal.TBEventDisplay.TBEventStore import openReader, isStore
 
-from HGCal.TBStandaloneSimulator.TBFileReader import TBFileReader
 from HGCal.TBStandaloneSimulator.TBGeometryUtil import *
 from string import *
 from ROOT import *
@@ -51,6 +78,10 @@ R_ONESHOT = 0
 R_FORWARD = 1
 
 MINDELAY  = 0.2
+PREFETCH  = 10    # number of events read ahead by the event player
+CACHESIZE = 64    # memory budget (MB) of the decoded event cache
+REFRESH   = 2.0   # in accumulate mode, longest time (s) between updates
+FOLLOWPOLL= 1.0   # in follow mode, time (s) between checks of the file
 
 DEBUG = 0
 
@@ -145,39 +176,54 @@ PAGES = [(0, 'Channels',   'ADCCounts(self, page)', None),
 #
 #         statusBar                  (TGSTatusBar)
 #-----------------------------------------------------------------------------
-class TBEventDisplay:
+class TBEventDisplay(DataCache):
     """
     gui = TBEventDisplay(title)
     """
 
     def __init__(self, title, geometryModule,
-                 filename=None, width=WIDTH, height=HEIGHT):
+                 filename=None, width=WIDTH, height=HEIGHT, page=None,
+                 follow=False, poll=FOLLOWPOLL, timings=None,
+                 pedestals=None, ksigma=3.0, quantity='sample0',
+                 gains=None):
 
         # Initial directory for open file dialog
         self.openDir  = os.environ['PWD']
         self.filename = filename
+        # per-event stage timings are written here on exit
+        self.timings  = timings
 
         self.pageNameMap = {}
+        self.pageIdMap   = {}
+        self.constructor = {}
         for idd, pageName, constructor, buttons in PAGES:
             self.pageNameMap[idd] = pageName
+            self.pageIdMap[pageName] = idd
+            self.constructor[pageName] = constructor
+        if page == None:
+            page = PAGES[0][1]
 
         self.Color = root.Color
         self.accumulate = False
-        # in accumulate mode update every self.skip events
+        # in accumulate mode the player updates the display every
+        # self.skip events, or after self.refresh seconds
         self.skip       = 50
+        self.refresh    = REFRESH
         self.ADCmin     = 300     # minimum number of adc counts
         self.setMaxAll  = False   # set all histograms to the same maximum
-        self.cellmap    = HGCCellMap()
-        # histogram cache (one per sensor)
-        self.hist       = []
-        # get test beam geometry
-        geometry        = createGeometry(geometry=geometryModule)
-        self.geometry   = geometry['geometry']
-        self.sensitive  = geometry['sensitive']
         self.shutterOpen= False
 
-        # create 2-D histograms for each sensor
+        # get test beam geometry and create 2-D histograms for each sensor
+        self.initGeometry(geometryModule)
         self.initDataCache()
+        self.decoder.ksigma = ksigma
+        self.decoder.quantity = quantity
+        if pedestals != None:
+            self.decoder.pedestals = self.decoder.newPedestals()
+            self.decoder.pedestals.load(pedestals)
+        if gains != None:
+            self.decoder.gains = self.decoder.newGains()
+            self.decoder.gains.load(gains)
 
         #-------------------------------------------------------------------
         # Create main frame
@@ -204,6 +250,8 @@ class TBEventDisplay:
                          [('&Open',  'openFile'),
                           ('&Close', 'closeFile'),
                           0,
+                          ('Save timings', 'saveTimings'),
+                          0,
                           ('E&xit',  'exit')])
 
         self.menuBar.Add('Edit',
@@ -215,8 +263,29 @@ class TBEventDisplay:
                           ('&Previous', 'previousEvent'),
                           ('&Goto',     'gotoEvent'),
                           0,
+                          ('Build event index',         'buildIndex'),
+                          ('Next with total ADC > X',   'nextTotalADC'),
+                          ('Next with N layers hit',    'nextLayersHit'),
+                          0,
+                          ('Accumulate range...',       'accumulateRange'),
+                          ('Cancel accumulate',         'cancelAccumulate'),
+                          0,
+                          ('Follow file',               'toggleFollow'),
+                          ('Set follow interval',       'setFollowPoll'),
+                          0,
                           ('Set min[ADC]', 'setADCmin'),
-                          ('Set delay',    'setDelay')])
+                          ('Set delay',    'setDelay'),
+                          ('Set accumulate update', 'setSkip'),
+                          ('Set accumulate refresh', 'setRefresh'),
+                          ('Set read-ahead', 'setPrefetch'),
+                          ('Set cache size', 'setCacheSize'),
+                          0,
+                          ('Load pedestals',  'loadPedestals'),
+                          ('Save pedestals',  'savePedestals'),
+                          ('Learn pedestals', 'toggleLearnPedestals'),
+                          ('Set noise cut',   'setNoiseCut'),
+                          ('Set pulse quantity', 'setQuantity'),
+                          ('Load gain calibration', 'loadGains')])
 
         self.menuBar.Add('Help',
                          [('About', 'about'),
@@ -286,27 +355,24 @@ class TBEventDisplay:
         self.noteBook = NoteBook(self, self.vframe, 
                                  'setPage', width, height)
 
-        # Add pages 
+        # Add pages. A page and its display are created when the page
+        # is first selected (see createPage).
         self.display = {}
         for idd, pageName, constructor, sidebar in PAGES:
-            self.noteBook.Add(pageName, sidebar)
-            self.noteBook.SetPage(pageName)
-            page = self.noteBook.page
-            print '\t==> add display: %s\t-->\t%s' % (pageName, constructor)
-            obj = eval(constructor)
-            self.display[pageName] = obj
+            self.noteBook.Add(pageName, sidebar, lazy=True)
 
         #-------------------------------------------------------------------
-        # Create a status bar, divided into two parts
+        # Create a status bar, divided into six parts
         #-------------------------------------------------------------------
         self.statusBar = TGStatusBar(self.vframe, 1, 1, kDoubleBorder)
         self.statusBar.SetHeight(22)
         status_parts = array('i')
-        status_parts.append(18)
-        status_parts.append(18)
-        status_parts.append(24)
-        status_parts.append(20)
-        status_parts.append(20)
+        status_parts.append(16)
+        status_parts.append(16)
+        status_parts.append(22)
+        status_parts.append(16)
+        status_parts.append(15)
+        status_parts.append(15)
         self.statusBar.SetParts(status_parts, len(status_parts))
         self.progressBar = ProgressBar(self, self.statusBar)
         self.vframe.AddFrame(self.statusBar, TOP_X)
@@ -317,6 +383,29 @@ class TBEventDisplay:
         self.eventNumber = -1
         self.Delay  = MINDELAY
         self.DELAY  = int(1000*MINDELAY)
+        self.prefetchDepth = PREFETCH
+        self.prefetcher    = None
+        self.cache  = EventCache(CACHESIZE*1024*1024)
+        self.pending  = 0         # events filled but not yet drawn
+        self.lastDraw = 0.0
+        # background accumulation over a range of events
+        self.accumulator = None
+        self.jobTimer = TTimer()
+        self.jobTimerConnection = Connection(self.jobTimer, 'Timeout()',
+                                             self, 'manageAccumulator')
+        # follow mode: show the newest event of a file being written
+        self.watcher    = None
+        self.following  = False
+        self.followPoll = poll
+        self.followTimer= TTimer()
+        self.followTimerConnection = Connection(self.followTimer,
+                                                'Timeout()',
+                                                self, 'manageFollow')
+        self.incoming   = RateMeter()
+        self.displayed  = RateMeter()
+        self.index  = None
+        self.totalADCmin = 10000
+        self.layersHit   = 2
         self.mutex  = TMutex(kFALSE)
         self.timer  = TTimer()
         self.timerConnection = Connection(self.timer, 'Timeout()',
@@ -330,11 +419,17 @@ class TBEventDisplay:
         self.main.Resize()
         self.main.MapWindow()
 
+        # graphics style: before any page is built, so that every page,
+        # whenever it is first visited, is built with it
+        self.setStyle()
+
+        # show initial page
+        self.setPage(self.pageIdMap[page])
+
         if filename != None: 
             self.__openFile(filename)
-
-        # graphics style
-        self.setStyle()
+        if follow:
+            self.toggleFollow()
 
         # To DEBUG a display uncomment next line
         #self.setPage(2)
@@ -355,60 +450,133 @@ class TBEventDisplay:
 
     def openFile(self):
         dialog = Dialog(self.root, self.main)
-        self.filename = dialog.SelectFile(kFDOpen, self.openDir)
+        filename = dialog.SelectFile(kFDOpen, self.openDir)
         self.openDir = dialog.IniDir()
-        if self.filename[-5:] != '.root':
+        # a root file, a text file listing the files of a run, or the
+        # meta.json file of a hit store
+        if os.path.basename(filename) == 'meta.json':
+            filename = os.path.dirname(filename)
+        elif filename[-5:] not in ['.root', '.list'] and \
+                filename[-4:] != '.txt':
             dialog.ShowText("Oops!",
-                            "Please select a root file",
+                            "Please select a root file or a file list",
                             230, 30)
             return
-        self.__openFile(self.filename)
+        self.__openFile(filename)
 
 
-    def __openFile(self, filename):
-        self.filename = filename
+    def __openFile(self, files):
+        # files: a file, or a list, glob or directory of the files of a
+        # run, shown as one sequence of events
         self.closeFile()		
-        self.reader = TBFileReader(filename)
+        if isinstance(files, str): files = [files]
+        if len(files) != 1 or not isStore(files[0]):
+            if len(expandFiles(files)) == 0:
+                dialog = Dialog(self.root, self.main)
+                dialog.SetText('Oops!', 'No root files found', 230, 24)
+                return
+        self.reader = openReader(files)
+        self.filename = self.reader.name
         self.nevents= self.reader.entries()
+        # only the last file of a run can still be growing
+        if isinstance(self.reader, FileChain):
+            self.watcher = FileWatcher(self.reader.files[-1])
+            self.watcher.poll()
+        self.index  = EventIndex(self.reader.files, len(self.sensitive),
+                                 self.decoder.settings())
         self.statusBar.SetText('events: %d' % self.nevents, 0)
-        self.statusBar.SetText(filename, 2)
+        self.statusBar.SetText(self.filename, 2)
         self.eventNumber = -1
         self.nextEvent()
         self.progressBar.SetRange(0, self.nevents)
         self.progressBar.SetPosition(self.eventNumber)
-        self.filetime = time.ctime(os.path.getctime(filename))
         
     def refreshFile(self):
-        try:
-            t = self.filetime
-        except:
-            return
-        if self.filetime == time.ctime(os.path.getctime(self.filename)):
-            return                 
-        else:      
-            eventNumber = self.eventNumber  
-            self.reader = TBFileReader(self.filename)
-            self.nevents= self.reader.entries()
-            self.statusBar.SetText('event: %d / %d' % \
-                                       (eventNumber, self.nevents-1), 0)
-            self.filetime = time.ctime(os.path.getctime(self.filename))
-            self.eventNumber = eventNumber
-        
+        # pick up events added to the file since it was opened. The
+        # watcher's check is cheap; the reader is rebuilt only if the
+        # number of events has changed. Returns the number of new events.
+        if self.watcher == None: return 0
+        added = self.reader.refresh(self.watcher.poll())
+        if added == 0: return 0
+        self.nevents= self.reader.entries()
+        self.statusBar.SetText('event: %d / %d' % \
+                                   (self.eventNumber, self.nevents-1), 0)
+        self.progressBar.SetRange(0, self.nevents)
+        return added
+
+    def toggleFollow(self):
+        self.following = not self.following
+        if self.following and self.watcher != None:
+            self.stopPlayer()
+            self.followTimer.Start(int(1000*self.followPoll), kFALSE)
+            self.statusBar.SetText('following %s' % self.filename, 1)
+        else:
+            self.following = False
+            self.followTimer.Stop()
+            self.statusBar.SetText('', 4)
+
+    def setFollowPoll(self):
+        from string import atof
+        dialog = Dialog(self.root, self.main)
+        seconds= atof(dialog.GetInput('Check file every (s)',
+                                      '%10.3f' % self.followPoll))
+        self.followPoll = max(0.1, seconds)
+        if self.following:
+            self.followTimer.Start(int(1000*self.followPoll), kFALSE)
+        self.statusBar.SetText('follow interval set to: %8.2f s' % \
+                                   self.followPoll, 1)
+
+    def manageFollow(self):
+        # called by the follow timer: if events have arrived, show the
+        # newest one. Events that arrived in between are skipped, so the
+        # display never falls behind the data taking.
+        if self.accumulator != None: return
+        added = self.refreshFile()
+        incoming  = self.incoming.add(max(added, 0))
+        displayed = self.displayed.add(0)
+        if added > 0 and self.nevents > 0:
+            self.eventNumber = self.nevents - 1
+            self.readEvent(R_ONESHOT)
+            self.displayEvent()
+            displayed = self.displayed.add(1)
+        self.statusBar.SetText('in %5.1f/s shown %5.1f/s' % \
+                                   (incoming, displayed), 4)
+
     def closeFile(self):
+        self.stopPlayer(False)
+        self.cancelAccumulate()
+        if self.watcher != None:
+            self.watcher.close()
+            self.watcher = None
+        self.pending = 0
         try:
-            if self.reader.file().IsOpen():
-                self.reader.file().Close()
-                del self.reader
+            self.reader.close()
+            del self.reader
         except:
             pass
 
     def setPage(self, idd):
         self.pageName = self.pageNameMap[idd]
+        self.createPage(self.pageName)
         self.noteBook.SetPage(idd)
         if self.eventNumber >= 0:
             self.displayEvent()
 
+    def createPage(self, pageName):
+        if self.display.has_key(pageName): return
+        # a page may be created after a file has been opened; its
+        # histograms must belong to gROOT, not to whichever file is the
+        # current directory, or they would be deleted with that file
+        context = TDirectory.TContext(gROOT)
+        self.noteBook.Build(pageName)
+        page = self.noteBook.pages[self.pageIdMap[pageName]]
+        constructor = self.constructor[pageName]
+        print '\t==> add display: %s\t-->\t%s' % (pageName, constructor)
+        self.display[pageName] = eval(constructor)
+        del context
+
     def nextEvent(self):
+        if self.accumulating(): return
         self.debug("begin:nextEvent")
         if self.eventNumber > self.nevents-2:
             self.eventNumber = 0
@@ -417,6 +585,7 @@ class TBEventDisplay:
         self.debug("end:nextEvent")			
 
     def previousEvent(self):
+        if self.accumulating(): return
         self.debug('begin:previousEvent')
         if self.eventNumber < 1:
             self.eventNumber = self.nevents 
@@ -425,6 +594,7 @@ class TBEventDisplay:
         self.debug('end:previousEvent')
 
     def gotoEvent(self):
+        if self.accumulating(): return
         self.debug('begin:gotoEvent')
         from string import atoi
         dialog = Dialog(self.root, self.main)
@@ -439,35 +609,239 @@ class TBEventDisplay:
         self.displayEvent()
         self.debug('end:gotoEvent')
 
+    def buildIndex(self):
+        # summarize the events not yet in the index of this file.
+        # Returns False if there is no file.
+        try:
+            reader = self.reader
+        except:
+            dialog = Dialog(self.root, self.main)
+            dialog.SetText('Oops!', 'First open a root file',
+                           230, 24)
+            return False
+        if self.accumulating(): return False
+        if len(self.index) >= self.nevents: return True
+
+        self.debug('begin:buildIndex')
+        self.statusBar.SetText('building event index...', 1)
+        def progress(number):
+            if number % 100 != 0: return
+            self.progressBar.SetPosition(number)
+            gSystem.ProcessEvents()
+        self.index.update(self.reader, self.decoder, self.nevents, progress)
+        self.progressBar.SetPosition(self.eventNumber)
+        self.statusBar.SetText('event index: %d events' % len(self.index), 1)
+        self.debug('end:buildIndex')
+        return True
+
+    def nextTotalADC(self):
+        from string import atof
+        dialog = Dialog(self.root, self.main)
+        self.totalADCmin = atof(dialog.GetInput('Next event with '\
+                                                    'total ADC >',
+                                                '%d' % self.totalADCmin))
+        if not self.buildIndex(): return
+        self.jumpTo(self.index.nextTotalADC(self.eventNumber,
+                                            self.totalADCmin))
+
+    def nextLayersHit(self):
+        from string import atoi
+        dialog = Dialog(self.root, self.main)
+        self.layersHit = atoi(dialog.GetInput('Next event with number of '\
+                                                  'layers hit >=',
+                                              '%d' % self.layersHit))
+        if not self.buildIndex(): return
+        self.jumpTo(self.index.nextLayersHit(self.eventNumber,
+                                             self.layersHit,
+                                             self.ADCmin))
+
+    def accumulateRange(self):
+        # sum an event range into the data cache in the background and
+        # draw once at the end
+        try:
+            reader = self.reader
+        except:
+            dialog = Dialog(self.root, self.main)
+            dialog.SetText('Oops!', 'First open a root file',
+                           230, 24)
+            return
+        if self.accumulator != None: return
+
+        dialog = Dialog(self.root, self.main)
+        spec   = dialog.GetInput('Accumulate events (e.g. 0-999; '\
+                                     'empty for all)',
+                                 '0-%d' % (self.nevents-1))
+        events = decodeEventList(spec, self.nevents)
+        if len(events) == 0: return
+
+        self.stopPlayer()
+        # start from an empty cache unless already accumulating
+        if not self.accumulate:
+            self.clearBins()
+            self.accumulate = True
+            self.accumulateButton.SetState(kButtonDown)
+
+        self.debug('begin:accumulateRange')
+        self.accumulator = Accumulator(self.reader.clone(), self.decoder,
+                                       self.store, events)
+        self.accumulator.start()
+        self.jobTimer.Start(200, kFALSE)
+        self.statusBar.SetText('accumulating %d events...' % len(events), 1)
+
+    def cancelAccumulate(self):
+        if self.accumulator == None: return
+        self.accumulator.cancel()
+        self.manageAccumulator()
+
+    def accumulating(self):
+        # while an Accumulate range job runs, the actions that would fill
+        # the data cache (navigation, player) are refused: the job's sums
+        # are added to it when it ends
+        if self.accumulator == None: return False
+        self.statusBar.SetText('accumulating: wait or cancel first', 1)
+        return True
+
+    def manageAccumulator(self):
+        # called by the job timer: track the accumulator and, when it is
+        # done, add its sums to the data cache and draw
+        job = self.accumulator
+        if job == None:
+            self.jobTimer.Stop()
+            return
+        self.progressBar.Track(job.processed, len(job.events))
+        if job.is_alive(): return
+
+        self.jobTimer.Stop()
+        self.accumulator = None
+        self.progressBar.SetRange(0, self.nevents)
+        self.progressBar.SetPosition(self.eventNumber)
+        if job.wasCancelled():
+            self.statusBar.SetText('accumulate cancelled', 1)
+            self.debug('end:accumulateRange - cancelled')
+            return
+        self.fillDataCacheCounts(job.counts, job.saturated)
+        self.statusBar.SetText('accumulated %d events in %.1f s '\
+                                   '(%.0f/s)' % (job.processed, job.elapsed,
+                                                 job.rate()), 1)
+        self.forceRedraw()
+        self.displayEvent()
+        self.debug('end:accumulateRange')
+
+    def jumpTo(self, eventNumber):
+        # jump to an event found with the event index
+        if self.accumulating(): return
+        if eventNumber < 0:
+            self.statusBar.SetText('no such event after %d' % \
+                                       self.eventNumber, 1)
+            return
+        self.eventNumber = eventNumber
+        self.readEvent(R_ONESHOT)
+        self.displayEvent()
+
     def forwardPlayer(self):
+        if self.accumulating(): return
         self.debug('begin:forwardPlayer')
         self.mutex.Lock()
         self.forward = True
+        first = self.eventNumber + 1
+        if first > self.nevents-1:
+            first = 0
+        self.startPrefetcher(first, 1)
         self.timer.Start(self.DELAY, kFALSE)
         self.mutex.UnLock()
         self.debug('end:forwardPlayer')
         
     def rewindPlayer(self):
+        if self.accumulating(): return
         self.debug('begin:rewindPlayer')
         self.mutex.Lock()
         self.forward = False
+        first = self.eventNumber - 1
+        if first < 0:
+            first = self.nevents-1
+        self.startPrefetcher(first, -1)
         self.timer.Start(self.DELAY, kFALSE)
         self.mutex.UnLock()
         self.debug('end:rewindPlayer')
 
-    def stopPlayer(self):
+    def stopPlayer(self, flush=True):
         self.debug('begin:stopPlayer')
         self.mutex.Lock()
         self.timer.Stop()
         self.cycle = False
+        self.stopPrefetcher()
         self.mutex.UnLock()
+        # show the events accumulated since the last update
+        if flush and self.pending > 0:
+            self.displayEvent()
         self.debug('end:stopPlayer - STOP REQUESTED')
 
     def managePlayer(self):
-        if self.forward:
-            self.nextEvent()
-        else:
-            self.previousEvent()
+        # draw the next event decoded by the prefetcher; if it is not
+        # ready yet, wait for the next tick of the timer. In accumulate
+        # mode, fill every event that is ready and draw only every
+        # self.skip events or self.refresh seconds.
+        if self.prefetcher == None:
+            self.stepPlayer()
+            return
+        nread = 0
+        while True:
+            event = self.prefetcher.pop()
+            if event is None: break
+            nread += 1
+            self.eventNumberPrev = self.eventNumber
+            self.eventNumber, hits, times = event
+            self.stages.event(self.eventNumber)
+            self.stages.record('read',   times[0])
+            self.stages.record('decode', times[1])
+            self.cache.put((self.filename, self.eventNumber), hits)
+            self.fillDataCache(hits)
+            if not self.accumulate: break
+        if nread == 0:
+            if self.prefetcher.done():
+                self.stopPlayer()
+            return
+        self.pending += nread
+        self.statusBar.SetText('event: %d / %d' % \
+                                   (self.eventNumber, self.nevents-1), 0)
+        self.forceRedraw()
+        if self.eventNumber <= 0 or self.eventNumber >= self.nevents-1:
+            self.stopPlayer()
+            return
+        if self.accumulate and self.pending < self.skip and \
+                time.time() - self.lastDraw < self.refresh:
+            return
+        self.displayEvent()
+
+    def stepPlayer(self):
+        # the player while the pedestals are learned: each event is read
+        # on this thread, when it is due, since it must be decoded with
+        # the pedestals learned from those before it
+        self.pending += 1
+        self.readEvent([R_REWIND, R_FORWARD][self.forward])
+        # at either end the player is stopped and the events shown
+        if self.pending == 0: return
+        if self.accumulate and self.pending < self.skip and \
+                time.time() - self.lastDraw < self.refresh:
+            return
+        self.displayEvent()
+
+    def startPrefetcher(self, first, step):
+        self.stopPrefetcher()
+        # nothing is read ahead while the pedestals are learned
+        if self.decoder.learn: return
+        # in accumulate mode read far enough ahead to fill a whole update
+        depth = self.prefetchDepth
+        if self.accumulate:
+            depth = max(depth, self.skip)
+        self.prefetcher = Prefetcher(self.reader.clone(), self.decoder,
+                                     first, step, self.nevents, depth)
+        self.prefetcher.start()
+
+    def stopPrefetcher(self):
+        if self.prefetcher == None: return
+        self.prefetcher.stop()
+        self.prefetcher = None
        
     def snapCanvas(self):
         self.shutterOpen = True
@@ -490,8 +864,30 @@ class TBEventDisplay:
 
     def exit(self):
         self.closeFile()
+        if self.timings:
+            self.stages.dump(self.timings)
+            print self.stages.summary()
         gApplication.Terminate()
 
+    def saveTimings(self):
+        dialog = Dialog(self.root, self.main)
+        filename = strip(dialog.GetInput('Write timings to CSV file',
+                                         'timings.csv'))
+        if filename == '': return
+        self.stages.dump(filename)
+        print self.stages.summary()
+        self.statusBar.SetText('timings written to %s' % filename, 1)
+
+    def showRate(self):
+        # events per second and the 95th percentile of the slowest stage
+        worst, p95 = '', 0.0
+        for stage in STAGES:
+            n, mean, p50, t, p99 = self.stages.stats(stage)
+            if n > 0 and t > p95:
+                worst, p95 = stage, t
+        self.statusBar.SetText('%5.1f ev/s %s p95 %5.1f ms' % \
+                                   (self.stages.eventRate(), worst, p95), 5)
+
     def notdone(self):
         dialog = Dialog(self.root, self.main)
         dialog.SetText('Not done', 'Sorry!', 230, 30)
@@ -505,11 +901,22 @@ class TBEventDisplay:
         pageNumber = self.noteBook.pageNumber
         page = self.noteBook.pages[pageNumber]
         self.debug("begin:displayEvent - %s" % page.name)
-        self.refreshFile()
-        # pass event display object to draw
-        self.display[page.name].Draw(self)
+        self.pending  = 0
+        self.lastDraw = time.time()
+        # pass event display object to draw, unless the page already
+        # shows the current contents of the data cache with the
+        # current settings
+        key = (self.generation, self.ADCmin, self.accumulate, self.setMaxAll)
+        if page.redraw or page.key != key or self.shutterOpen:
+            start = self.stages.mark()
+            self.display[page.name].Draw(self)
+            self.stages.add('draw', start)
+            page.key = key
+        else:
+            self.debug("skip:displayEvent - %s unchanged" % page.name)
         self.redraw = False
         page.redraw = False
+        self.showRate()
         self.debug("end:displayEvent")	
 
     def readEvent(self, which=R_ONESHOT):
@@ -526,14 +933,17 @@ class TBEventDisplay:
         # cache previous event number
         self.eventNumberPrev = self.eventNumber
 
+        # in follow mode the follow timer checks the file
+        if not self.following:
+            self.refreshFile()
+
         # loop over events and apply ADC cut
 
         if   which == R_ONESHOT:
             self.statusBar.SetText('event: %d / %d' % \
                                        (self.eventNumber, self.nevents-1),
                                    0)            
-            self.reader.read(self.eventNumber)
-            self.fillDataCache()
+            self.fillDataCache(self.loadEvent(self.eventNumber))
 
         elif which == R_FORWARD:
             if self.eventNumber < self.nevents-1:
@@ -541,124 +951,52 @@ class TBEventDisplay:
                 self.statusBar.SetText('event: %d / %d' % \
                                            (self.eventNumber, self.nevents-1),
                                        0)
-                self.reader.read(self.eventNumber)
-                self.fillDataCache()
+                self.fillDataCache(self.loadEvent(self.eventNumber))
         else:
             if self.eventNumber > 0:
                 self.eventNumber -= 1
                 self.statusBar.SetText('event: %d / %d' % \
                                            (self.eventNumber, self.nevents-1),
                                        0)
-                self.reader.read(self.eventNumber)
-                self.fillDataCache()
+                self.fillDataCache(self.loadEvent(self.eventNumber))
 
         if self.eventNumber <= 0 or self.eventNumber >= self.nevents-1:
             self.stopPlayer()
 
+        self.forceRedraw()
+        self.debug("end:readEvent")
+
+    def loadEvent(self, eventNumber):
+        # read and decode one event, unless it is in the event cache.
+        # This is the only place where the pedestals are learned: while
+        # they are, every event is decoded again, so that it is learned
+        # and has the pedestals learned so far subtracted.
+        key = (self.filename, eventNumber)
+        learn = self.decoder.learn
+        found = False
+        if not learn:
+            found, hits = self.cache.find(key)
+        self.stages.event(eventNumber)
+        if not found:
+            start = self.stages.mark()
+            self.reader.read(eventNumber)
+            self.stages.add('read', start)
+            start = self.stages.mark()
+            hits = getHits(self.reader, self.decoder, learn=True)
+            self.stages.add('decode', start)
+            self.cache.put(key, hits)
+        self.statusBar.SetText('cache: %d hit / %d miss' % \
+                                   (self.cache.hits, self.cache.misses), 3)
+        return hits
+
+    def forceRedraw(self):
         # Force a re-drawing of pages of notebook when a page is made
         # visible
         keys = self.noteBook.pages.keys()
         for key in keys:
             self.noteBook.pages[key].redraw = True
 
-        self.debug("end:readEvent")
-
     
-    def initDataCache(self):
-        from copy import copy
-        # -------------------------------------------------------------
-        # create a histogram for each sensor
-        # Note: in offline, layers start at 1
-        # -------------------------------------------------------------
-        self.cells = {}
-        for l in xrange(len(self.sensitive)):
-            layer = l + 1
-            # we assume the cells for each layer to be identical
-            self.cells[layer] = copy(self.cellmap.cells(layer))
-            cells = self.cells[layer] # make an alias
-
-            #from pprint import PrettyPrinter
-            #pp = PrettyPrinter()
-            #pp.pprint(self.geometry)
-            #print self.sensitive[layer]
-
-            element = self.geometry[self.sensitive[layer]]
-            if not element.has_key('cellsize'):
-                sys.exit('** keyword cellsize not found - check %s' % \
-                             geometryModule)
-
-            if not element.has_key('side'):
-                sys.exit('** keyword side not found - check %s' % \
-                             geometryModule)
-
-            if not element.has_key('z'):
-                sys.exit('** keyword z not found - check %s' % \
-                             geometryModule)
-
-            cellside= element['cellsize']
-            side    = element['side']
-            z       = element['z']
-
-            poly = TH2Poly()
-            poly.SetName('layer %3d' % layer)
-            poly.SetTitle('layer %3d' % layer)
-            poly.GetXaxis().CenterTitle()
-            poly.GetXaxis().SetTitle("#font[12]{x} axis")
-            poly.GetYaxis().CenterTitle()
-            poly.GetYaxis().SetTitle("#font[12]{y} axis")
-
-            # populate histogram with cells
-            for ii in xrange(cells.size()):
-                cells[ii].z = z
-                xv, yv = computeBinVertices(cellside, cells[ii])
-                poly.AddBin(len(xv), xv, yv)
-
-            # cache sensor histogram
-            self.hist.append(poly)
-
-    def fillDataCache(self):
-        # -------------------------------------------------------------
-        if not self.accumulate:
-            for h in self.hist:
-                h.ClearBinContents()
-
-        self.hits = getHits(self, self.cellmap, self.sensitive)
-        if self.hits == None: return
-
-        # fill sensor histograms
-        layers = self.hits.keys()
-        layers.sort()
-        for layer in layers:
-            for hit in self.hits[layer]:
-                adc, u, v, x, y, z = hit
-                self.hist[layer-1].Fill(x, y, adc)
-                
-                #record ="cell(%3d,%3d,%3d|%6.2f,%6.2f): %d" % \
-                #    (layer, u ,v, x, y, adc)
-                #print record
-
-        # copy histogram counts into cell objects
-        for l, h in enumerate(self.hist):
-            layer = l + 1
-            cells = self.cells[layer] # make an alias
-            for ii in xrange(cells.size()):
-                cell = cells[ii]
-                cell.count = h.GetBinContent(ii+1)
-
-        self.maxCount = -1
-        for h in self.hist:
-            y = h.GetMaximum()
-            if y > self.maxCount:
-                self.maxCount = y
-
-        # set all histograms to min/max values
-        for h in self.hist:
-            h.SetMinimum(self.ADCmin)
-            if self.setMaxAll > 0:
-                h.SetMaximum(self.maxCount)
-            else:
-                h.SetMaximum()
-
     def setADCmin(self):
         from string import atof
         dialog = Dialog(self.root, self.main)
@@ -676,6 +1014,146 @@ class TBEventDisplay:
         self.DELAY = max(MINDELAY, int(1000*seconds))
         self.statusBar.SetText('delay set to: %8.2f s' % seconds, 1)
 
+    def setSkip(self):
+        from string import atoi
+        dialog = Dialog(self.root, self.main)
+        skip   = atoi(dialog.GetInput('In accumulate mode, update '\
+                                          'every N events',
+                                      '%d' % self.skip))
+        self.skip = max(1, skip)
+        self.statusBar.SetText('update every %d events' % self.skip, 1)
+
+    def setRefresh(self):
+        from string import atof
+        dialog = Dialog(self.root, self.main)
+        self.refresh = atof(dialog.GetInput('In accumulate mode, update '\
+                                                'at least every (s)',
+                                            '%10.3f' % self.refresh))
+        self.statusBar.SetText('update at least every %8.2f s' % \
+                                   self.refresh, 1)
+
+    def setPrefetch(self):
+        from string import atoi
+        dialog = Dialog(self.root, self.main)
+        depth  = atoi(dialog.GetInput('Enter number of events to read ahead',
+                                      '%d' % self.prefetchDepth))
+        self.prefetchDepth = max(1, depth)
+        self.statusBar.SetText('read-ahead set to: %d' % self.prefetchDepth,
+                               1)
+
+    def setCacheSize(self):
+        from string import atof
+        dialog = Dialog(self.root, self.main)
+        size   = atof(dialog.GetInput('Enter event cache size in MB',
+                                      '%d' % (self.cache.budget/1024/1024)))
+        self.cache.resize(int(max(0, size)*1024*1024))
+        self.statusBar.SetText('cache size set to: %d MB' % size, 1)
+
+    def loadPedestals(self):
+        dialog = Dialog(self.root, self.main)
+        filename = dialog.SelectFile(kFDOpen, self.openDir)
+        if filename[-4:] != '.npz':
+            dialog.ShowText("Oops!", "Please select a pedestal (.npz) file",
+                            230, 30)
+            return
+        pedestals = self.decoder.newPedestals()
+        try:
+            pedestals.load(filename)
+        except (IOError, KeyError), message:
+            dialog.ShowText("Oops!", str(message), 230, 30)
+            return
+        self.decoder.pedestals = pedestals
+        self.redecode()
+        self.statusBar.SetText('pedestals: %s' % filename, 1)
+
+    def savePedestals(self):
+        if self.decoder.pedestals is None: return
+        dialog = Dialog(self.root, self.main)
+        filename = strip(dialog.GetInput('Write pedestals to file',
+                                         'pedestals.npz'))
+        if filename == '': return
+        self.decoder.pedestals.save(filename)
+        self.statusBar.SetText('pedestals written to %s' % filename, 1)
+
+    def toggleLearnPedestals(self):
+        # update the pedestals from the events being shown
+        self.stopPlayer()
+        decoder = self.decoder
+        decoder.learn = not decoder.learn
+        if decoder.learn and decoder.pedestals is None:
+            # pedestals are now subtracted as they are learned
+            decoder.pedestals = decoder.newPedestals()
+            self.redecode()
+        elif not decoder.learn and decoder.pedestals is not None:
+            # the cached events and the event index were made with
+            # pedestals that were still being learned
+            self.redecode()
+        self.statusBar.SetText('learn pedestals: %s' % \
+                                   ['off', 'on'][decoder.learn], 1)
+
+    def setNoiseCut(self):
+        from string import atof
+        dialog = Dialog(self.root, self.main)
+        self.decoder.ksigma = atof(dialog.GetInput('Drop hits less than '\
+                                                       'k x noise above '\
+                                                       'pedestal: k =',
+                                                   '%4.1f' % \
+                                                       self.decoder.ksigma))
+        self.redecode()
+        self.statusBar.SetText('noise cut set to: %4.1f sigma' % \
+                                   self.decoder.ksigma, 1)
+
+    def setQuantity(self):
+        # the pulse quantity shown as the adc count of each hit
+        dialog = Dialog(self.root, self.main)
+        quantity = strip(dialog.GetInput('Show (%s)' % \
+                                             ', '.join(QUANTITIES),
+                                         self.decoder.quantity))
+        if quantity not in QUANTITIES:
+            dialog.ShowText("Oops!", "Unknown quantity %s" % quantity,
+                            230, 30)
+            return
+        self.decoder.quantity = quantity
+        self.redecode()
+        self.statusBar.SetText('showing: %s' % quantity, 1)
+
+    def loadGains(self):
+        # merge saturated high-gain samples with the low gain
+        dialog = Dialog(self.root, self.main)
+        filename = dialog.SelectFile(kFDOpen, self.openDir)
+        if filename == '' or filename == None: return
+        gains = self.decoder.newGains()
+        try:
+            gains.load(filename)
+        except (IOError, ValueError), message:
+            dialog.ShowText("Oops!", str(message), 230, 30)
+            return
+        self.decoder.gains = gains
+        self.redecode()
+        self.statusBar.SetText('gains: %s' % filename, 1)
+
+    def redecode(self):
+        # the events read ahead by the player, those in the cache and the
+        # event index were decoded with the old settings, and so are the
+        # sums of a running Accumulate range job
+        self.cancelAccumulate()
+        self.stopPlayer(False)
+        self.cache.clear()
+        try:
+            reader = self.reader
+        except:
+            return
+        self.index = EventIndex(reader.files, len(self.sensitive),
+                                self.decoder.settings())
+        if self.nevents > 0 and self.eventNumber >= 0:
+            # accumulated counts would mix the old and new settings (and
+            # count the current event twice): start again from this event
+            if self.accumulate:
+                self.clearBins()
+                self.statusBar.SetText('accumulation restarted', 1)
+            self.readEvent(R_ONESHOT)
+            self.displayEvent()
+
 
     def setStyle(self):
         self.style = TStyle("Pub", "Pub")
@@ -784,23 +1262,59 @@ class TBEventDisplay:
         # Postscript options:
         style.SetPaperSize(20.,20.)
         style.cd()
+        # the palette has changed
+        colorTable.update()
 #------------------------------------------------------------------------------
 def main():
-    if len(sys.argv) > 1:
-        geometry = sys.argv[1]
-    else:
-        sys.exit('''
-Usage:
-     TBEventDisplay.py <geometry-file> [root-file]
-''')
-
-    if len(sys.argv) > 2:
-        filename = sys.argv[2]
-    else:
-        filename = None
-
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='TBEventDisplay.py',
+                            epilog='TBEventDisplay.py --batch --help '\
+                                'lists the options for rendering '\
+                                'pages without a display; '\
+                                'TBEventDisplay.py --benchmark --help '\
+                                'those for timing synthetic events')
+    parser.add_argument('geometry', help='geometry file')
+    parser.add_argument('filename', nargs='*',
+                        help='root files of SKIROC data frames: files, '\
+                            'globs, run directories or text files '\
+                            'listing files; or a hit store')
+    parser.add_argument('--page', default=PAGES[0][1],
+                        choices=[p[1] for p in PAGES],
+                        help='page shown at start-up (default: %(default)s)')
+    parser.add_argument('--follow', action='store_true',
+                        help='follow a file that is being written, '\
+                            'showing its newest event')
+    parser.add_argument('--poll', type=float, default=FOLLOWPOLL,
+                        help='in follow mode, seconds between checks '\
+                            'of the file (default: %(default)s)')
+    parser.add_argument('--timings', default=None, metavar='CSV',
+                        help='on exit, write the time of each stage '\
+                            'of each event to this file')
+    parser.add_argument('--pedestals', default=None, metavar='NPZ',
+                        help='subtract the pedestals in this file '\
+                            '(see --pedestal-run)')
+    parser.add_argument('--ksigma', type=float, default=3.0,
+                        help='with --pedestals, drop hits less than this '\
+                            'many noise rms above pedestal')
+    parser.add_argument('--quantity', default='sample0', choices=QUANTITIES,
+                        help='pulse quantity shown as the adc count of '\
+                            'each hit (default: %(default)s)')
+    parser.add_argument('--gains', default=None, metavar='TXT',
+                        help='replace saturated high-gain samples by the '\
+                            'low gain, using the calibration in this file')
+    options = parser.parse_args()
+
+    # the prefetcher and accumulator read in worker threads
+    enableThreads()
     display = TBEventDisplay('CMS HGCAL Test Beam Event Display',
-                             geometry, filename)
+                             options.geometry, options.filename or None,
+                             page=options.page,
+                             follow=options.follow, poll=options.poll,
+                             timings=options.timings,
+                             pedestals=options.pedestals,
+                             ksigma=options.ksigma,
+                             quantity=options.quantity,
+                             gains=options.gains)
     display.run()
 #------------------------------------------------------------------------------
 try:
@@ -7,6 +7,7 @@
      As simple as possible
 */
 // Created: April 2016 Harrison B. Prosper
+// Updated: 18-Oct-2026 picking of the digits of a digit set
 //-----------------------------------------------------------------------------
 #include <cassert>
 #include <algorithm>
@@ -22,7 +23,8 @@ Pickable::Pickable()
   : _selection(gEve->GetSelection()),
     _element2id(map<TEveElement*, int>()),
     _id2element(map<int, TEveElement*>()),
-    _id(0)
+    _id(0),
+    _digit(-1)
 {
   _selection->Connect("SelectionAdded(TEveElement*)", "Pickable", 
 		      this, "Selected(TEveElement*)");
@@ -48,6 +50,36 @@ Pickable::AddElement(TEveElement* element)
   _id++;
 }
 
+void
+Pickable::AddDigits(TEveDigitSet* digits)
+{
+  AddElement(digits);
+  digits->SetPickable(kTRUE);
+  digits->SetAlwaysSecSelect(kTRUE);
+  digits->SetEmitSignals(kTRUE);
+  digits->Connect("SecSelected(TEveDigitSet*,Int_t)", "Pickable",
+		  this, "DigitSelected(TEveDigitSet*,Int_t)");
+}
+
+void
+Pickable::DigitSelected(TEveDigitSet* digits, Int_t idx)
+{
+  _digit = idx;
+  Picked(_element2id[digits]);
+}
+
+int
+Pickable::Digit() const
+{
+  return _digit;
+}
+
+void 
+Pickable::Picked(int id)   
+{ 
+  this->Emit("Picked(int)", id); 
+}
+
 void
 Pickable::Clear()
 {
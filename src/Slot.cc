@@ -4,6 +4,7 @@
 // Created: Summer-2002 Harrison B. Prosper
 // Updated: 05-Jun-2008 HBP Adapt to CMS
 //          14-Apr-2011 HBP use unsigned long
+//          18-Oct-2026 take the GIL: the event loop runs without it
 ///////////////////////////////////////////////////////////////////////
 //$Revision: 1.2 $
 
@@ -23,6 +24,8 @@ Slot::Slot(PyObject* object, const char *method)
     _method(std::vector<char>(_mstr.size()+1,0))
 {
   copy(_mstr.begin(), _mstr.end(), _method.begin());
+  // needed by PyGILState_Ensure (a no-op if already done)
+  PyEval_InitThreads();
 }
 
 Slot::~Slot() 
@@ -35,22 +38,32 @@ void Slot::handleSignal(int id)
 {
   char ip[4] = {"(i)"};
 
+  // the GUI thread does not hold the GIL while it waits in the event
+  // loop (so that worker threads can run), so take it here
+  PyGILState_STATE state = PyGILState_Ensure();
+
   PyObject* result = PyObject_CallMethod(_object, &_method[0], ip, id);
   if ( PyErr_Occurred() ) PyErr_Clear();
 
   // Decrement reference count. Use XDECREF to ignore NULL references
   
   Py_XDECREF(result);
+
+  PyGILState_Release(state);
 }
 
 void Slot::handleSignal()
 {
+  PyGILState_STATE state = PyGILState_Ensure();
+
   PyObject* result = PyObject_CallMethod(_object, &_method[0], NULL);
   if ( PyErr_Occurred() ) PyErr_Clear();
 
   // Decrement reference count. Use XDECREF to ignore NULL references
   
   Py_XDECREF(result);
+
+  PyGILState_Release(state);
 }
 
 